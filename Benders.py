@@ -1,52 +1,62 @@
+import time
+
 import pyomo.environ as pyo
-from pyomo.opt import SolverFactory
+
+import scenario_decomposition
+import solvers
+from cut_cache import system_data_key
+from cut_pool import CutPool
+from solution import model_solution
+from system_data import default_system_data
 
 
-def masterProblem(dict_of_cuts):
+def build_masterProblem(scenario_probs=None, data=None, level=False):
     """
     The master problem aka the first 24 hours of the optimization problem, and the part of the problem that
     has the deterministic input, and a "dummy variable"-alpha, to represent the subproblem solution.
 
-    The solution to this part of the overall problem returns the complicating variable v_res[24],
-    and contains the optimal solution to the complete optimization problem
+    The model is built once, with an empty list of cuts. The cuts are added one by one with add_cut_masterProblem,
+    so the same model can be kept alive and re-solved for the whole Benders_loop.
+    With scenario_probs ({scenario: probability}) alpha is split in one alpha_s pr. scenario, for multi-cut Benders
+    With level=True the (inactive) level set problem of solve_level_masterProblem is added as well
+    The input data is taken from data (a SystemData), by default the data of the project task
     """
+    if data is None:
+        data = default_system_data()
+
     # Set data
-    T1 = list(range(1, 25))      # Hour 1-24
+    T1 = data.T1                 # Hour 1-24
 
     # Parameters data
-    M3S_TO_MM3 = 3.6/1000        # Convesion factor to MM^3
-    MP = 50                      # Start-value of market price
-    Q_max = 100 * M3S_TO_MM3     # Mm^3
-    P_max = 100                  # MW (over 1 hour)
-    E_conv = 0.981 / M3S_TO_MM3  # MWh/Mm^3
-    V_max = 10                   # Mm^3
-    IF_1 = 50 * M3S_TO_MM3       # Mm^3/h, Inflow Stage 1
-    V_01 = 5                     # Mm^3, initial water level, Stage 1
+    Q_max = data.Q_max           # Mm^3
+    P_max = data.P_max           # MW (over 1 hour)
+    V_max = data.V_max           # Mm^3
+    alpha_max = max(1000000, float(data.P_max * data.price[len(T1):].sum() + data.WV_end * V_max))  # bound on the stage 2 profits, so alpha is never cut off
 
     # -------- Initiate masterproblem -------------
     mastermodel = pyo.ConcreteModel()
 
     # -------- Declaring sets ---------------------
     mastermodel.T1 = pyo.Set(initialize=T1)
-    mastermodel.dict_of_cuts = dict_of_cuts
+
     # -------- Declaring parameters ---------------
-    mastermodel.MP = pyo.Param(initialize=MP)           # Market price at t
-    mastermodel.Q_max = pyo.Param(initialize=Q_max)     # Max discharge of water to hydropower unit
-    mastermodel.P_max = pyo.Param(initialize=P_max)     # Max power production of hydropower unit
-    mastermodel.E_conv = pyo.Param(initialize=E_conv)   # Conversion of power, p, produced pr. discarged water, q
-    mastermodel.V_max = pyo.Param(initialize=V_max)     # Max water capacity in reservoir
-    mastermodel.IF_1 = pyo.Param(initialize=IF_1)       # Inflow in stage 1, deterministic
-    mastermodel.V_01 = pyo.Param(initialize=V_01)       # Initial water level t = 1
+    mastermodel.MP = pyo.Param(mastermodel.T1, initialize=data.price_dict(T1))       # Market price at t
+    mastermodel.Q_max = pyo.Param(initialize=Q_max)                                  # Max discharge of water to hydropower unit
+    mastermodel.P_max = pyo.Param(initialize=P_max)                                  # Max power production of hydropower unit
+    mastermodel.E_conv = pyo.Param(initialize=data.E_conv)                           # Conversion of power, p, produced pr. discarged water, q
+    mastermodel.V_max = pyo.Param(initialize=V_max)                                  # Max water capacity in reservoir
+    mastermodel.IF_1 = pyo.Param(mastermodel.T1, initialize=data.inflow_stage1_dict())  # Inflow in stage 1, deterministic
+    mastermodel.V_01 = pyo.Param(initialize=data.V_01)                               # Initial water level t = 1
 
     # -------- Declaring decision variables -------
-    mastermodel.alpha = pyo.Var(bounds=(-1000000, 1000000))          # alpha is the masterproblem's substitute for the subproblem
+    mastermodel.alpha = pyo.Var(bounds=(-alpha_max, alpha_max))          # alpha is the masterproblem's substitute for the subproblem
     mastermodel.q1 = pyo.Var(mastermodel.T1, bounds=(0, Q_max))      # variable of discharged water from reservoir in T1
     mastermodel.p1 = pyo.Var(mastermodel.T1, bounds=(0, P_max))      # variable for production of power in T1
     mastermodel.v_res1 = pyo.Var(mastermodel.T1, bounds=(0, V_max))  # variable for reservoir level in T1
 
     # -------- Declaring Objective function --------
     def objective(mastermodel):
-        obj = sum(mastermodel.p1[t] * (mastermodel.MP + t) for t in mastermodel.T1) + mastermodel.alpha
+        obj = sum(mastermodel.p1[t] * mastermodel.MP[t] for t in mastermodel.T1) + mastermodel.alpha
         return obj      # profits for T1 + the alpha "dummy variable"
     mastermodel.OBJ = pyo.Objective(rule=objective(mastermodel), sense=pyo.maximize)  # setting the objective to maximize profits
 
@@ -56,50 +66,171 @@ def masterProblem(dict_of_cuts):
     mastermodel.constr_productionDependency1 = pyo.Constraint(mastermodel.T1, rule=math_production1)
 
     def math_v_res1(mastermodel, t):  # variable dependency for production in T1
-        if t == 1:  # setting the start value of water reservoir at the start of day 1
-            return mastermodel.v_res1[t] == mastermodel.V_01 + mastermodel.IF_1 - mastermodel.q1[t]  # water reservoir = initial volume + inflow - discharge
+        if t == T1[0]:  # setting the start value of water reservoir at the start of day 1
+            return mastermodel.v_res1[t] == mastermodel.V_01 + mastermodel.IF_1[t] - mastermodel.q1[t]  # water reservoir = initial volume + inflow - discharge
         else:  # for the rest of time in T1
-            return mastermodel.v_res1[t] == mastermodel.v_res1[t - 1] + mastermodel.IF_1 - mastermodel.q1[t]  # water reservoir = previous water level + inflow - discharge
+            return mastermodel.v_res1[t] == mastermodel.v_res1[t - 1] + mastermodel.IF_1[t] - mastermodel.q1[t]  # water reservoir = previous water level + inflow - discharge
     mastermodel.constr_math_v_res1 = pyo.Constraint(mastermodel.T1, rule=math_v_res1)
 
-    mastermodel.listOfCuts = pyo.ConstraintList()  # A constraint of a list of constraints based on cuts
-    for cut in dict_of_cuts.keys():  # Going through all the keys in the cut dictionary generated in the SDP_loop
-        mastermodel.listOfCuts.add(mastermodel.alpha <= mastermodel.dict_of_cuts[cut]['a'] * mastermodel.v_res1[24] + mastermodel.dict_of_cuts[cut]['b'])
-        # adding the 'a' and 'b' value from dict_cuts to generate a "Y = ax + b" linear cut, where 'x' is the v_res1[24] complicating variable from this "next" iteration
+    if scenario_probs is not None:  # multi-cut, alpha is the probability-weighted sum of one alpha pr. scenario
+        mastermodel.S = pyo.Set(initialize=list(scenario_probs))
+        mastermodel.Prob_s = pyo.Param(mastermodel.S, initialize=scenario_probs)    # Probability of each scenario
+        mastermodel.alpha_s = pyo.Var(mastermodel.S, bounds=(-alpha_max, alpha_max))   # alpha for each scenario
 
-    # ---------- Initializing solver and solving the problem ----------
-    SolverFactory('gurobi').solve(mastermodel)
+        def math_alpha(mastermodel):
+            return mastermodel.alpha == sum(mastermodel.Prob_s[s] * mastermodel.alpha_s[s] for s in mastermodel.S)
+        mastermodel.constr_alpha = pyo.Constraint(rule=math_alpha)
+
+    mastermodel.listOfCuts = pyo.ConstraintList()  # A constraint of a list of constraints based on cuts, filled by add_cut_masterProblem
+
+    if level:  # the level set problem, only active while solve_level_masterProblem solves it
+        mastermodel.center = pyo.Param(initialize=data.V_01, mutable=True)   # v_res1[24] of the best solution so far
+        mastermodel.level = pyo.Param(initialize=0, mutable=True)            # the objective the solution must reach
+        mastermodel.distance_up = pyo.Var(bounds=(0, V_max))                 # v_res1[24] above the center
+        mastermodel.distance_down = pyo.Var(bounds=(0, V_max))               # v_res1[24] below the center
+
+        def math_center(mastermodel):  # always active, the distances are free to follow v_res1[24]
+            return mastermodel.v_res1[mastermodel.T1.last()] - mastermodel.center == mastermodel.distance_up - mastermodel.distance_down
+        mastermodel.constr_center = pyo.Constraint(rule=math_center)
+
+        def math_level(mastermodel):  # profits for T1 + alpha at least the level
+            return mastermodel.OBJ.expr >= mastermodel.level
+        mastermodel.constr_level = pyo.Constraint(rule=math_level)
+        mastermodel.constr_level.deactivate()
+
+        mastermodel.OBJ_level = pyo.Objective(expr=mastermodel.distance_up + mastermodel.distance_down, sense=pyo.minimize)
+        mastermodel.OBJ_level.deactivate()  # the distance from the center, minimized instead of OBJ
+
+    return mastermodel
+
+
+def add_cut_masterProblem(mastermodel, cut, opt=None):
+    """
+    Function to append one cut to the listOfCuts of an already built master problem.
+    If a persistent solver is given, only the new constraint is sent to the solver, the rest of the model is kept as is.
+    A cut with a scenario 's' (multi-cut) bounds the alpha of that scenario instead of the weighted alpha
+    """
+    alpha = mastermodel.alpha_s[cut['s']] if 's' in cut else mastermodel.alpha
+    new_cut = mastermodel.listOfCuts.add(alpha <= cut['a'] * mastermodel.v_res1[mastermodel.T1.last()] + cut['b'])
+    # adding the 'a' and 'b' value from the cut to generate a "Y = ax + b" linear cut, where 'x' is the v_res1[24] complicating variable
+
+    if opt is not None:
+        solvers.add_constraint(opt, new_cut)  # the persistent solver keeps its model, so only the new row is added
+
+    return new_cut
+
+
+def remove_cut_masterProblem(mastermodel, cut_constraint, opt=None):
+    """
+    Function to take a cut added by add_cut_masterProblem out of the master problem again, used by the cut pool
+    """
+    if opt is not None:
+        solvers.remove_constraint(opt, cut_constraint)  # removing the row from the persistent solver as well
+    cut_constraint.deactivate()
+
+
+def solve_masterProblem(mastermodel, opt, callback=None):
+    """
+    Function to (re-)solve the master problem with the given solver.
+    With a persistent solver the previous basis is kept, so the solver warm-starts from the last iteration
+    If a callback is given (see instrumentation.EventLog), a 'solve' event is sent with the solve time and status
+    """
+    start = time.perf_counter()
+    results = opt.solve(mastermodel, load_solutions=True)
 
     OBJ_value = round(mastermodel.OBJ(), 2)  # rounding to two decimal points
     print(f'\nThe total objective value is: {OBJ_value}')
 
-    return mastermodel.v_res1[24].value
+    v_res1_t24 = mastermodel.v_res1[mastermodel.T1.last()].value
+    if callback is not None:
+        callback('solve', problem='master', time=time.perf_counter() - start,
+                 status=results.solver.termination_condition, objective=mastermodel.OBJ(), state=v_res1_t24)
+
+    return v_res1_t24
+
+
+def solve_level_masterProblem(mastermodel, opt, level, center, callback=None):
+    """
+    Function to solve the level set problem of a master problem built with level=True, aka level-bundle stabilization:
+    the v_res1[24] closest to center (the state of the best solution so far) where the profits for T1 + alpha are
+    at least level. Plain cutting planes jump between the extreme values of v_res1[24], this keeps the next state near
+    the best one while the cuts are still poor. The master problem with OBJ is restored after the solve
+    If a callback is given (see instrumentation.EventLog), a 'solve' event is sent with the solve time and status
+    """
+    start = time.perf_counter()
+    mastermodel.center = center
+    mastermodel.level = level
+    solvers.update_constraint(opt, mastermodel.constr_center)  # a persistent solver does not see parameter changes
+
+    mastermodel.constr_level.activate()
+    solvers.add_constraint(opt, mastermodel.constr_level)
+    mastermodel.OBJ.deactivate()
+    mastermodel.OBJ_level.activate()
+    solvers.update_objective(opt, mastermodel.OBJ_level)
+
+    results = opt.solve(mastermodel, load_solutions=True)
+    v_res1_t24 = mastermodel.v_res1[mastermodel.T1.last()].value
+
+    mastermodel.constr_level.deactivate()  # back to the master problem
+    solvers.remove_constraint(opt, mastermodel.constr_level)
+    mastermodel.OBJ_level.deactivate()
+    mastermodel.OBJ.activate()
+    solvers.update_objective(opt, mastermodel.OBJ)
+
+    if callback is not None:
+        callback('solve', problem='level', time=time.perf_counter() - start,
+                 status=results.solver.termination_condition, objective=mastermodel.OBJ(), state=v_res1_t24)
 
+    return v_res1_t24
 
-def subProblem(v_res_t24, num_scenario):
+
+def masterProblem(dict_of_cuts, scenario_probs=None, data=None, solver=None):
+    """
+    The master problem aka the first 24 hours of the optimization problem, and the part of the problem that
+    has the deterministic input, and a "dummy variable"-alpha, to represent the subproblem solution.
+
+    The solution to this part of the overall problem returns the complicating variable v_res[24],
+    and contains the optimal solution to the complete optimization problem.
+    Builds a new model with all the cuts in dict_of_cuts, for a one-off solve. Benders_loop keeps one model alive instead
+    Returns the Solution (see solution.py) with the dispatch of the first 24 hours, alpha and v_res[24] as the state
+    """
+    mastermodel = build_masterProblem(scenario_probs, data)
+    mastermodel.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)  # to import the duals of the reservoir balances
+
+    for cut in dict_of_cuts.keys():  # Going through all the keys in the cut dictionary
+        add_cut_masterProblem(mastermodel, dict_of_cuts[cut])
+
+    # ---------- Initializing solver and solving the problem ----------
+    solve_masterProblem(mastermodel, solvers.make_solver(solver))
+    return model_solution(mastermodel)
+
+
+def build_subProblem(num_scenario, scenario=None, data=None):
     """
     The sub-problem aka the last 24 hours of the optimization problem, and the part of the problem that
     contains the stochastic input.
     The solution to this part of the problem provides the data to generate cuts and solve the entire problem
     through the Master problem with the applied cuts.
+
+    The model is built once with v_res_t24 as a mutable parameter, so it can be re-solved for new state values
+    with solve_subProblem, without building the model again.
+    The scenario argument picks the one scenario to model when num_scenario == 1, used by scenario_decomposition
+    The input data is taken from data (a SystemData), by default the data of the project task
     """
+    if data is None:
+        data = default_system_data()
+
     # ---------- Set data ----------
-    T2 = list(range(25, 49))     # Hour 25-48
+    T2 = data.T2                 # Hour 25-48
     if num_scenario == 1:        # for running only one scenario, num_scenario written in SDP_loop
-        S = [2]                  # the scenario being run
+        S = [2] if scenario is None else [scenario]  # the scenario being run, chosen by the scenario decomposition
     else:
-        S = list(range(0, 5))    # if not one, we run all 5 scenario's 0-4
+        S = data.S               # if not one, we run all 5 scenario's 0-4
 
     # Parameters data
-    M3S_TO_MM3 = 3.6/1000        # Convesion factor to MM^3
-    MP = 50                      # Start-value of market price
-    WV_end = 13000               # EUR/Mm^3
-    prob = 0.2                   # 1/5 pr scenario
-    Q_max = 100 * M3S_TO_MM3     # Mm^3
-    P_max = 100                  # MW (over 1 hour)
-    E_conv = 0.981 / M3S_TO_MM3  # MWh/Mm^3
-    V_max = 10                   # Mm^3
-    IF_2 = 25 * M3S_TO_MM3       # Mm^3/h, Inflow Stage 2
+    Q_max = data.Q_max           # Mm^3
+    P_max = data.P_max           # MW (over 1 hour)
+    V_max = data.V_max           # Mm^3
 
     modelSub = pyo.ConcreteModel()
 
@@ -108,15 +239,15 @@ def subProblem(v_res_t24, num_scenario):
     modelSub.S = pyo.Set(initialize=S)          # Scenarios, s
 
     # ---------- Declaring parameters ----------
-    modelSub.MP = pyo.Param(initialize=MP)                    # Market price at t
-    modelSub.WV = pyo.Param(initialize=WV_end)                # Water value at t = 48
-    modelSub.Prob = pyo.Param(initialize=prob)                # Probability of scenario
-    modelSub.Q_max = pyo.Param(initialize=Q_max)              # Max discharge of water to hydropower unit
-    modelSub.P_max = pyo.Param(initialize=P_max)              # Max power production of hydropower unit
-    modelSub.E_conv = pyo.Param(initialize=E_conv)            # Conversion of power, p, produced pr. discarged water, q
-    modelSub.V_max = pyo.Param(initialize=V_max)              # Max water capacity in reservoir
-    modelSub.IF_2 = pyo.Param(initialize=IF_2)                # Inflow in stage 2, stochastic
-    modelSub.v_res_t24 = pyo.Param(initialize=v_res_t24)      # value of v_res is in t=24 from the master problem solve
+    modelSub.MP = pyo.Param(modelSub.T2, initialize=data.price_dict(T2))              # Market price at t
+    modelSub.WV = pyo.Param(initialize=data.WV_end)                                  # Water value at t = 48
+    modelSub.Prob = pyo.Param(modelSub.S, initialize=data.probability_dict(S))       # Probability of scenario
+    modelSub.Q_max = pyo.Param(initialize=Q_max)                                     # Max discharge of water to hydropower unit
+    modelSub.P_max = pyo.Param(initialize=P_max)                                     # Max power production of hydropower unit
+    modelSub.E_conv = pyo.Param(initialize=data.E_conv)                              # Conversion of power, p, produced pr. discarged water, q
+    modelSub.V_max = pyo.Param(initialize=V_max)                                     # Max water capacity in reservoir
+    modelSub.IF_2 = pyo.Param(modelSub.T2, modelSub.S, initialize=data.inflow_stage2_dict(S))  # Inflow in stage 2, stochastic
+    modelSub.v_res_t24 = pyo.Param(initialize=0, mutable=True)  # value of v_res is in t=24 from the master problem solve, set by solve_subProblem
 
     # ---------- Declaring decision variables ----------
     modelSub.q2 = pyo.Var(modelSub.T2, modelSub.S, bounds=(0, Q_max))       # variable of discharged water from reservoir in T2 pr. scenario
@@ -127,18 +258,18 @@ def subProblem(v_res_t24, num_scenario):
     # ---------- Objective function ----------
     def objective(modelSub):
         if num_scenario == 1:
-            o2 = sum(sum(modelSub.p2[t, s] * (modelSub.MP + t) for t in modelSub.T2) for s in
+            o2 = sum(sum(modelSub.p2[t, s] * modelSub.MP[t] for t in modelSub.T2) for s in
                      modelSub.S)  # profits for T2 for the one scenario chosen to be run
-            o3 = sum(modelSub.WV * modelSub.v_res2[48, s] for s in
+            o3 = sum(modelSub.WV * modelSub.v_res2[T2[-1], s] for s in
                      modelSub.S)  # profits from Water Value * remaining reservoir level at the end of day 2
             obj = o2 + o3  # summing all profit areas
             return obj
 
         else:
-            o2 = sum(sum(modelSub.Prob * modelSub.p2[t, s] * (modelSub.MP + t) for t in modelSub.T2) for s in
+            o2 = sum(sum(modelSub.Prob[s] * modelSub.p2[t, s] * modelSub.MP[t] for t in modelSub.T2) for s in
                      modelSub.S)  # profits for T2 for each scenario * probability
-            o3 = modelSub.Prob * sum(
-                modelSub.WV * modelSub.v_res2[48, s] for s in
+            o3 = sum(
+                modelSub.Prob[s] * modelSub.WV * modelSub.v_res2[T2[-1], s] for s in
                 modelSub.S)  # profits from Water Value * remaining reservoir level at the end of day 2 * probabilities and over all scenarios
             obj = o2 + o3  # summing all profit areas
             return obj
@@ -151,56 +282,248 @@ def subProblem(v_res_t24, num_scenario):
     modelSub.constr_productionDependency2 = pyo.Constraint(modelSub.T2, modelSub.S, rule=math_production2)
     
     def math_v_res2(modelSub, t, s):  # variable dependency for production in T2
-        if t == 25:     # setting the start value of water reservoir at the start of day 2
-            return modelSub.v_res2[t, s] == modelSub.v_res_t24_var + (modelSub.IF_2 * s) - modelSub.q2[t, s]  # water reservoir = initial volume + inflow - discharge
+        if t == T2[0]:  # setting the start value of water reservoir at the start of day 2
+            return modelSub.v_res2[t, s] == modelSub.v_res_t24_var + modelSub.IF_2[t, s] - modelSub.q2[t, s]  # water reservoir = initial volume + inflow - discharge
         else:  # for the rest of time in T2
-            return modelSub.v_res2[t, s] == modelSub.v_res2[(t-1), s] + (modelSub.IF_2 * s) - modelSub.q2[t, s]  # water reservoir = previous water level + inflow - discharge
+            return modelSub.v_res2[t, s] == modelSub.v_res2[(t-1), s] + modelSub.IF_2[t, s] - modelSub.q2[t, s]  # water reservoir = previous water level + inflow - discharge
     modelSub.constr_math_v_res2 = pyo.Constraint(modelSub.T2, modelSub.S, rule=math_v_res2)
 
     def v_res_start(modelSub):  # constraint to explain the v_res relationship in t = 24 so we can get the dual value
         return modelSub.v_res_t24_var == modelSub.v_res_t24
     modelSub.constr_dualvalue = pyo.Constraint(rule=v_res_start)
 
-    # ---------- Initializing solver and solving the problem ----------
-    opt = SolverFactory('gurobi')
-    modelSub.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)
-    opt.solve(modelSub)
+    modelSub.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)  # to import the dual of the v_res_start constraint
+
+    return modelSub
+
+
+def solve_subProblem(modelSub, opt, v_res_t24, callback=None):
+    """
+    Function to re-solve a built subproblem for a new value of the state variable.
+    Only the right-hand side of constr_dualvalue changes, so with a persistent solver only that constraint is
+    replaced and the solver warm-starts from the previous solve
+    If a callback is given (see instrumentation.EventLog), a 'solve' event is sent with the solve time and status
+    """
+    start = time.perf_counter()
+    modelSub.v_res_t24 = v_res_t24  # updating the mutable parameter with the new state value
+
+    solvers.update_constraint(opt, modelSub.constr_dualvalue)  # a persistent solver does not see parameter changes
+
     results = opt.solve(modelSub, load_solutions=True)
+    solvers.load_duals(opt, [modelSub.constr_dualvalue])  # only the dual needed for the cut is loaded
 
     obj_value = modelSub.OBJ()
     dual_value = modelSub.dual.get(modelSub.constr_dualvalue)
 
+    if callback is not None:
+        callback('solve', problem='sub', time=time.perf_counter() - start,
+                 status=results.solver.termination_condition, objective=obj_value, dual=dual_value, state=v_res_t24)
+
     return obj_value, dual_value  # returning the OBJ and dual of v_res_start constraint to be used in cut generation
 
 
-def generate_cuts(OBJ, dual, v_res1, it, dict_of_cuts):
+def subProblem(v_res_t24, num_scenario, data=None, solver=None):
     """
-    Function to generate linear cuts and add them to the cut dictionary to be put into the master problem
+    Function to build and solve the subproblem once for the given state value.
+    Returns the Solution (see solution.py), its objective and state_dual are the OBJ and Dual to generate cuts.
+    Loops solving many states should build once and use solve_subProblem
+    """
+    modelSub = build_subProblem(num_scenario, data=data)
+
+    # ---------- Initializing solver and solving the problem ----------
+    solve_subProblem(modelSub, solvers.make_solver(solver), v_res_t24)
+    return model_solution(modelSub)
+
+
+def generate_cuts(OBJ, dual, v_res1, it, dict_of_cuts, scenario=None):
+    """
+    Function to generate linear cuts and add them to the cut dictionary to be put into the master problem.
+    With a scenario the cut is a multi-cut for that scenario's alpha
     """
     b = OBJ - dual * v_res1         # calculating value 'b' for the linear function
     cut = {'a': dual, 'b': b}
+    if scenario is not None:
+        cut['s'] = scenario         # the scenario the cut belongs to, for multi-cut Benders
     dict_of_cuts[it] = cut          # adding the cut values to the cut dictionary
 
 
-def Benders_loop():
+def Benders_loop(decomposed=False, multi_cut=False, max_workers=None,
+                 max_iterations=100, rel_gap=1e-6, abs_gap=None, time_limit=None, use_cut_pool=False, max_age=None,
+                 level=None, data=None, solver=None, callback=None, cache=None):
     """
     The run-function for Benders Decomposition.
     The masterproblem returns the state variable used as input in the subproblem
     Based on the state variable, the subproblem returns the objective and the state-variables dual
     A weighted cut is generated pr. iteration based on the subproblem's returned data.
     Lastly, the cuts are added as constraints in the masterproblem, and the cycle continues.
+
+    With decomposed=True each scenario is solved as its own LP on a process pool of max_workers processes,
+    and combined into the weighted cut. With multi_cut=True as well, one cut pr. scenario is added instead
+
+    The loop stops when the gap between the upper bound (master objective with alpha) and the lower bound
+    (first 24 hours profit + the true expected value from the subproblem) is within rel_gap or abs_gap, after
+    max_iterations, or when time_limit seconds have passed. Returns the Solution (see solution.py) of the master
+    problem with all the cuts, the Benders dispatch of the first 24 hours, and the bounds of each iteration
+
+    With use_cut_pool=True the cuts go through a CutPool, so duplicates are not added and dominated cuts are removed
+    from the master problem. With max_age as well, cuts that are not binding for max_age iterations are retired
+
+    With level (a number between 0 and 1, e.g. 0.7) the master problem is stabilized with a level set: after the
+    master problem gives the upper bound, the subproblem is solved in the v_res1[24] closest to the best solution
+    so far where the master objective reaches lower + level * (upper - lower), see solve_level_masterProblem.
+    The cuts and bounds are the same as without it, only the states they are made in change. With a cache the
+    center is saved as well, so a resumed run is stabilized from its first iteration.
+    With one state variable the plain loop already needs few iterations: the level set cuts them up to about
+    half with 20-50 scenarios, but with few scenarios it can take 1-3 iterations more (7 against 5 with the
+    default data), so it is off by default
+    The input data is taken from data (a SystemData), by default the data of the project task
+    solver is the name of the solver to use, by default gurobi if a license is free, else an open-source solver
+
+    callback is called as callback(event, **fields) for every model build ('build'), master- and subproblem solve
+    ('solve'), scenario-decomposed solve ('scenarios'), new cut ('cut') and iteration ('iteration'), e.g. an
+    instrumentation.EventLog to log them as JSON lines. Without a callback nothing extra is done
+
+    With a cache (a cut_cache.CutCache) the cuts are saved after every iteration under a key of the system data.
+    A new run with the same data starts with the saved cuts in the master problem and goes on from the saved
+    iteration, so a stopped run is resumed, and a finished one converges in the first iteration.
+    max_iterations is the number of iterations of this run
     """
+    if data is None:
+        data = default_system_data()  # the system data is made once and passed to every model
+    solver = solvers.select_solver(solver)  # the same solver for all the models, and the worker processes
+
     num_scenario = 5  # Change to 1 to run for 1 scenario. Change the scenario to run in the top of the subproblem function
+    S = data.S        # scenario's solved one by one in the decomposed mode
     dict_of_cuts = {}
+    cutpool = CutPool(0, data.V_max, max_age=max_age) if use_cut_pool else None
+    cut_constraints = {}        # the master problem constraint of each cut in dict_of_cuts
 
-    for iteration in range(1, 7):
+    if decomposed:
+        pool = scenario_decomposition.create_pool(build_subProblem, solve_subProblem, max_workers, solver, data)
+        scenario_probs = data.probability_dict() if multi_cut else None
+    else:
+        start = time.perf_counter()
+        modelSub = build_subProblem(num_scenario, data=data)  # the subproblem is built once, only the state value changes
+        opt_sub = solvers.make_solver(solver, persistent=True)
+        solvers.set_instance(opt_sub, modelSub)
+        if callback is not None:
+            callback('build', problem='sub', time=time.perf_counter() - start, solver=solver)
+        scenario_probs = None
+
+    start = time.perf_counter()
+    mastermodel = build_masterProblem(scenario_probs, data, level=level is not None)  # the master problem is built once and kept for all iterations
+    opt = solvers.make_solver(solver, persistent=True)  # persistent solver, keeps the model and basis between the solves
+    solvers.set_instance(opt, mastermodel)
+    if callback is not None:
+        callback('build', problem='master', time=time.perf_counter() - start, solver=solver)
+
+    bounds = []                     # the bound trajectory, one entry pr. iteration
+    lower_bound = -float('inf')     # best found value of a feasible solution
+    center = None                   # the v_res1[24] of the best solution, the center of the level set
+    cut_states = {}                 # the v_res1[24] each cut was made in, saved with the cuts
+    first_iteration = 1
+
+    if cache is not None:  # starting from the cuts of an earlier run with the same data
+        cache_key = system_data_key(data, 'benders', num_scenario, decomposed, multi_cut)
+        stored = cache.load(cache_key)
+        if stored is not None:
+            stored_cuts, cut_states, last_iteration, lower_bound, center = stored
+            for key, cut in stored_cuts.items():
+                if cutpool is not None and not cutpool.add(key, cut):
+                    continue
+                dict_of_cuts[key] = cut
+                cut_constraints[key] = add_cut_masterProblem(mastermodel, cut, opt)
+            first_iteration = last_iteration + 1
+            print(f'Loaded {len(dict_of_cuts)} cuts from the cut cache, going on from iteration {first_iteration}')
+
+    def within_gap(gap):
+        return gap <= rel_gap * max(abs(lower_bound), 1e-10) or (abs_gap is not None and gap <= abs_gap)
+
+    start_time = time.perf_counter()
+
+    for iteration in range(first_iteration, first_iteration + max_iterations):
 
         print(f'Master problem iteration nr: {iteration}')
-        v_res1_t24 = masterProblem(dict_of_cuts)  # returning the state variable
-
-        OBJ, Dual = subProblem(v_res1_t24, num_scenario)  # with state variable as input, returning the data needed to generate cuts
+        v_res1_t24 = solve_masterProblem(mastermodel, opt, callback)  # returning the state variable
+        upper_bound = mastermodel.OBJ()                              # the cuts over-estimate the future, so this is an upper bound
+        first_stage_profit = mastermodel.OBJ() - mastermodel.alpha.value  # profits of the first 24 hours only
+
+        if cutpool is not None and max_age is not None:  # retiring the cuts that have not been binding for a while
+            alpha = {s: mastermodel.alpha_s[s].value for s in mastermodel.S} if scenario_probs is not None else mastermodel.alpha.value
+            for key in cutpool.update_ages(v_res1_t24, alpha):
+                remove_cut_masterProblem(mastermodel, cut_constraints.pop(key), opt)
+                del dict_of_cuts[key]
+
+        if level is not None and center is not None and not within_gap(upper_bound - lower_bound):
+            # the state of the level set near the best solution, instead of the extreme value the master problem gives
+            v_res1_t24 = solve_level_masterProblem(mastermodel, opt, lower_bound + level * (upper_bound - lower_bound),
+                                                   center, callback)
+            first_stage_profit = mastermodel.OBJ() - mastermodel.alpha.value  # profits of the first 24 hours in that state
 
         print(f'\n Generating cut nr: {iteration} based on:')
-        generate_cuts(OBJ, Dual, v_res1_t24, iteration, dict_of_cuts)  # generating cuts
-        print(f'{dict_of_cuts[iteration]} \n')
-
+        if not decomposed:
+            OBJ, Dual = solve_subProblem(modelSub, opt_sub, v_res1_t24, callback)  # with state variable as input, returning the data needed to generate cuts
+            generate_cuts(OBJ, Dual, v_res1_t24, iteration, dict_of_cuts)  # generating cuts
+            new_keys = [iteration]
+            expected_value = OBJ
+        else:
+            start = time.perf_counter()
+            scenario_results = scenario_decomposition.solve_scenarios(pool, S, v_res1_t24)  # one small LP pr. scenario
+            if callback is not None:  # the scenarios are solved in the worker processes, so only the total time is known
+                callback('scenarios', time=time.perf_counter() - start, state=v_res1_t24,
+                         results=[{'scenario': s, 'objective': OBJ, 'dual': Dual} for s, prob, OBJ, Dual in scenario_results])
+            expected_value = scenario_decomposition.combine_cut(scenario_results)[0]
+            if multi_cut:
+                new_keys = []
+                for s, prob, OBJ, Dual in scenario_results:
+                    generate_cuts(OBJ, Dual, v_res1_t24, (iteration, s), dict_of_cuts, scenario=s)  # one cut pr. scenario
+                    new_keys.append((iteration, s))
+            else:
+                OBJ, Dual = scenario_decomposition.combine_cut(scenario_results)  # the probability-weighted cut
+                generate_cuts(OBJ, Dual, v_res1_t24, iteration, dict_of_cuts)
+                new_keys = [iteration]
+
+        for key in new_keys:
+            print(f'{dict_of_cuts[key]} \n')
+            cut_states[key] = v_res1_t24
+            if cutpool is not None and not cutpool.add(key, dict_of_cuts[key]):  # the cut is already in the pool
+                del dict_of_cuts[key]
+                continue
+            cut_constraints[key] = add_cut_masterProblem(mastermodel, dict_of_cuts[key], opt)  # only the new cut is added to the master problem
+            if callback is not None:
+                callback('cut', iteration=iteration, key=key, **dict_of_cuts[key])
+
+        if cutpool is not None:  # removing the cuts that are dominated over the whole state range
+            for key in cutpool.prune():
+                remove_cut_masterProblem(mastermodel, cut_constraints.pop(key), opt)
+                del dict_of_cuts[key]
+
+        # ---------- Checking convergence ----------
+        if first_stage_profit + expected_value > lower_bound:  # the true value of this iteration's v_res1[24]
+            lower_bound, center = first_stage_profit + expected_value, v_res1_t24
+        gap = upper_bound - lower_bound
+        bounds.append({'iteration': iteration, 'upper': upper_bound, 'lower': lower_bound, 'gap': gap,
+                       'time': time.perf_counter() - start_time})
+        print(f'Upper bound: {round(upper_bound, 2)}, lower bound: {round(lower_bound, 2)}, gap: {round(gap, 4)}')
+        if callback is not None:
+            callback('iteration', **bounds[-1], cuts=len(dict_of_cuts),
+                     pool_size=len(cutpool) if cutpool is not None else None)
+        if cache is not None:  # saving after every iteration, to resume from here
+            cache.save(cache_key, dict_of_cuts, cut_states, iteration, lower_bound, center)
+
+        if within_gap(gap):
+            print(f'Converged after {iteration} iterations')
+            break
+        if time_limit is not None and time.perf_counter() - start_time >= time_limit:
+            print(f'Stopped by the time limit after {iteration} iterations')
+            break
+
+    if decomposed:
+        pool.shutdown()
+
+    # ---------- The dispatch with all the cuts ----------
+    mastermodel.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)  # to import the duals of the reservoir balances
+    solve_masterProblem(mastermodel, opt, callback)  # the last cut (or a level set solve) came after the last master solve
+    solvers.load_duals(opt, list(mastermodel.constr_math_v_res1.values()))
+
+    return model_solution(mastermodel), bounds
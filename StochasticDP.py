@@ -1,26 +1,40 @@
+import concurrent.futures
+import time
+
 import pyomo.environ as pyo
-from pyomo.opt import SolverFactory
+
+import scenario_decomposition
+import solvers
+from cut_cache import system_data_key
+from cut_pool import CutPool
+from solution import model_solution
+from system_data import default_system_data
+from future_cost import FutureCostFunction
 
 
-def masterProblem(dict_of_cuts):
+def masterProblem(dict_of_cuts, scenario_probs=None, data=None, solver=None, callback=None):
     """
     The master problem aka the first 24 hours of the optimization problem, and the part of the problem that
     has the deterministic input, and a "dummy variable"-alpha, to represent the subproblem solution.
 
     The solution to this part of the problem provides the optimal solution to the complete optimization problem.
+    With scenario_probs ({scenario: probability}) alpha is split in one alpha_s pr. scenario, for the multi-cuts
+    The input data is taken from data (a SystemData), by default the data of the project task
+    If a callback is given (see instrumentation.EventLog), a 'build' and a 'solve' event are sent
+    Returns the Solution (see solution.py) with the dispatch of the first 24 hours, alpha and v_res[24] as the state
     """
+    if data is None:
+        data = default_system_data()
+    start = time.perf_counter()
+
     # Set data
-    T1 = list(range(1, 25))      # Hour 1-24
+    T1 = data.T1                 # Hour 1-24
 
     # Parameters data
-    M3S_TO_MM3 = 3.6/1000        # Convesion factor to MM^3
-    MP = 50                      # Start-value of market price
-    Q_max = 100 * M3S_TO_MM3     # Mm^3
-    P_max = 100                  # MW (over 1 hour)
-    E_conv = 0.981 / M3S_TO_MM3  # MWh/Mm^3
-    V_max = 10                   # Mm^3
-    IF_1 = 50 * M3S_TO_MM3       # Mm^3/h, Inflow Stage 1
-    V_01 = 5                     # Mm^3, initial water level, Stage 1
+    Q_max = data.Q_max           # Mm^3
+    P_max = data.P_max           # MW (over 1 hour)
+    V_max = data.V_max           # Mm^3
+    alpha_max = max(1000000, float(data.P_max * data.price[len(T1):].sum() + data.WV_end * V_max))  # bound on the stage 2 profits, so alpha is never cut off
 
     # -------- Initiate masterproblem -------------
     mastermodel = pyo.ConcreteModel()
@@ -29,23 +43,23 @@ def masterProblem(dict_of_cuts):
     mastermodel.T1 = pyo.Set(initialize=T1)
     mastermodel.dict_of_cuts = dict_of_cuts
     # -------- Declaring parameters ---------------
-    mastermodel.MP = pyo.Param(initialize=MP)           # Market price at t
-    mastermodel.Q_max = pyo.Param(initialize=Q_max)     # Max discharge of water to hydropower unit
-    mastermodel.P_max = pyo.Param(initialize=P_max)     # Max power production of hydropower unit
-    mastermodel.E_conv = pyo.Param(initialize=E_conv)   # Conversion of power, p, produced pr. discarged water, q
-    mastermodel.V_max = pyo.Param(initialize=V_max)     # Max water capacity in reservoir
-    mastermodel.IF_1 = pyo.Param(initialize=IF_1)       # Inflow in stage 1, deterministic
-    mastermodel.V_01 = pyo.Param(initialize=V_01)       # Initial water level t = 1
+    mastermodel.MP = pyo.Param(mastermodel.T1, initialize=data.price_dict(T1))       # Market price at t
+    mastermodel.Q_max = pyo.Param(initialize=Q_max)                                  # Max discharge of water to hydropower unit
+    mastermodel.P_max = pyo.Param(initialize=P_max)                                  # Max power production of hydropower unit
+    mastermodel.E_conv = pyo.Param(initialize=data.E_conv)                           # Conversion of power, p, produced pr. discarged water, q
+    mastermodel.V_max = pyo.Param(initialize=V_max)                                  # Max water capacity in reservoir
+    mastermodel.IF_1 = pyo.Param(mastermodel.T1, initialize=data.inflow_stage1_dict())  # Inflow in stage 1, deterministic
+    mastermodel.V_01 = pyo.Param(initialize=data.V_01)                               # Initial water level t = 1
 
     # -------- Declaring decision variables -------
-    mastermodel.alpha = pyo.Var(bounds=(-1000000, 1000000))          # alpha is the masterproblem's substitute for the subproblem
+    mastermodel.alpha = pyo.Var(bounds=(-alpha_max, alpha_max))          # alpha is the masterproblem's substitute for the subproblem
     mastermodel.q1 = pyo.Var(mastermodel.T1, bounds=(0, Q_max))      # variable of discharged water from reservoir in T1
     mastermodel.p1 = pyo.Var(mastermodel.T1, bounds=(0, P_max))      # variable for production of power in T1
     mastermodel.v_res1 = pyo.Var(mastermodel.T1, bounds=(0, V_max))  # variable for reservoir level in T1
 
     # -------- Declaring Objective function --------
     def objective(mastermodel):
-        obj = sum(mastermodel.p1[t] * (mastermodel.MP + t) for t in mastermodel.T1) + mastermodel.alpha
+        obj = sum(mastermodel.p1[t] * mastermodel.MP[t] for t in mastermodel.T1) + mastermodel.alpha
         return obj      # profits for T1 + the alpha "dummy variable"
     mastermodel.OBJ = pyo.Objective(rule=objective(mastermodel), sense=pyo.maximize)  # setting the objective to maximize profits
 
@@ -55,50 +69,72 @@ def masterProblem(dict_of_cuts):
     mastermodel.constr_productionDependency1 = pyo.Constraint(mastermodel.T1, rule=math_production1)
 
     def math_v_res1(mastermodel, t):  # variable dependency for production in T1
-        if t == 1:  # setting the start value of water reservoir at the start of day 1
-            return mastermodel.v_res1[t] == mastermodel.V_01 + mastermodel.IF_1 - mastermodel.q1[t]  # water reservoir = initial volume + inflow - discharge
+        if t == T1[0]:  # setting the start value of water reservoir at the start of day 1
+            return mastermodel.v_res1[t] == mastermodel.V_01 + mastermodel.IF_1[t] - mastermodel.q1[t]  # water reservoir = initial volume + inflow - discharge
         else:  # for the rest of time in T1
-            return mastermodel.v_res1[t] == mastermodel.v_res1[t - 1] + mastermodel.IF_1 - mastermodel.q1[t]  # water reservoir = previous water level + inflow - discharge
+            return mastermodel.v_res1[t] == mastermodel.v_res1[t - 1] + mastermodel.IF_1[t] - mastermodel.q1[t]  # water reservoir = previous water level + inflow - discharge
     mastermodel.constr_math_v_res1 = pyo.Constraint(mastermodel.T1, rule=math_v_res1)
 
+    if scenario_probs is not None:  # multi-cut, alpha is the probability-weighted sum of one alpha pr. scenario
+        mastermodel.S = pyo.Set(initialize=list(scenario_probs))
+        mastermodel.Prob_s = pyo.Param(mastermodel.S, initialize=scenario_probs)    # Probability of each scenario
+        mastermodel.alpha_s = pyo.Var(mastermodel.S, bounds=(-alpha_max, alpha_max))   # alpha for each scenario
+
+        def math_alpha(mastermodel):
+            return mastermodel.alpha == sum(mastermodel.Prob_s[s] * mastermodel.alpha_s[s] for s in mastermodel.S)
+        mastermodel.constr_alpha = pyo.Constraint(rule=math_alpha)
+
     mastermodel.listOfCuts = pyo.ConstraintList()  # A constraint of a list of constraints based on cuts
+    mastermodel.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)  # to import the duals of the reservoir balances
     for cut in dict_of_cuts.keys():  # Going through all the keys in the cut dictionary generated in the SDP_loop
-        mastermodel.listOfCuts.add(mastermodel.alpha <= mastermodel.dict_of_cuts[cut]['a'] * mastermodel.v_res1[24] + mastermodel.dict_of_cuts[cut]['b'])
+        alpha = mastermodel.alpha_s[dict_of_cuts[cut]['s']] if 's' in dict_of_cuts[cut] else mastermodel.alpha  # multi-cuts bound their scenario's alpha
+        mastermodel.listOfCuts.add(alpha <= mastermodel.dict_of_cuts[cut]['a'] * mastermodel.v_res1[mastermodel.T1.last()] + mastermodel.dict_of_cuts[cut]['b'])
         # adding the 'a' and 'b' value from dict_cuts to generate a "Y = ax + b" linear cut, where 'x' is the v_res1[24] complicating variable from this "next" iteration
 
+    if callback is not None:
+        callback('build', problem='master', time=time.perf_counter() - start, cuts=len(dict_of_cuts))
+
     # ---------- Initializing solver and solving the problem ----------
-    SolverFactory('gurobi').solve(mastermodel)
+    start = time.perf_counter()
+    results = solvers.make_solver(solver).solve(mastermodel)
 
     OBJ_value = round(mastermodel.OBJ(), 2)  # rounding to two decimal points
     print(f'\nThe total objective value is: {OBJ_value}')
 
-    return mastermodel.v_res1[24].value
+    v_res1_t24 = mastermodel.v_res1[mastermodel.T1.last()].value
+    if callback is not None:
+        callback('solve', problem='master', time=time.perf_counter() - start,
+                 status=results.solver.termination_condition, objective=mastermodel.OBJ(), state=v_res1_t24)
+
+    return model_solution(mastermodel)
 
 
-def subProblem(v_res_guess, num_scenario):
+def build_subProblem(num_scenario, scenario=None, data=None):
     """
     The sub-problem aka the last 24 hours of the optimization problem, and the part of the problem that
     contains the stochastic input.
     The solution to this part of the problem provides the data to generate cuts and solve the entire problem
     through the Master problem.
+
+    The model is built once with v_res_guess as a mutable parameter, so it can be re-solved for new state values
+    with solve_subProblem, without building the model again.
+    The scenario argument picks the one scenario to model when num_scenario == 1, used by scenario_decomposition
+    The input data is taken from data (a SystemData), by default the data of the project task
     """
+    if data is None:
+        data = default_system_data()
+
     # ---------- Set data ----------
-    T2 = list(range(25, 49))     # Hour 25-48
+    T2 = data.T2                 # Hour 25-48
     if num_scenario == 1:        # for running only one scenario, num_scenario written in SDP_loop
-        S = [2]                  # the scenario being run
+        S = [2] if scenario is None else [scenario]  # the scenario being run, chosen by the scenario decomposition
     else:
-        S = list(range(0, 5))    # if not one, we run all 5 scenario's 0-4
+        S = data.S               # if not one, we run all 5 scenario's 0-4
 
     # Parameters data
-    M3S_TO_MM3 = 3.6/1000        # Convesion factor to MM^3
-    MP = 50                      # Start-value of market price
-    WV_end = 13000               # EUR/Mm^3
-    prob = 0.2                   # 1/5 pr scenario
-    Q_max = 100 * M3S_TO_MM3     # Mm^3
-    P_max = 100                  # MW (over 1 hour)
-    E_conv = 0.981 / M3S_TO_MM3  # MWh/Mm^3
-    V_max = 10                   # Mm^3
-    IF_2 = 25 * M3S_TO_MM3       # Mm^3/h, Inflow Stage 2
+    Q_max = data.Q_max           # Mm^3
+    P_max = data.P_max           # MW (over 1 hour)
+    V_max = data.V_max           # Mm^3
 
     modelSub = pyo.ConcreteModel()
 
@@ -107,15 +143,15 @@ def subProblem(v_res_guess, num_scenario):
     modelSub.S = pyo.Set(initialize=S)          # Scenarios, s
 
     # ---------- Declaring parameters ----------
-    modelSub.MP = pyo.Param(initialize=MP)                    # Market price at t
-    modelSub.WV = pyo.Param(initialize=WV_end)                # Water value at t = 48
-    modelSub.Prob = pyo.Param(initialize=prob)                # Probability of scenario
-    modelSub.Q_max = pyo.Param(initialize=Q_max)              # Max discharge of water to hydropower unit
-    modelSub.P_max = pyo.Param(initialize=P_max)              # Max power production of hydropower unit
-    modelSub.E_conv = pyo.Param(initialize=E_conv)            # Conversion of power, p, produced pr. discarged water, q
-    modelSub.V_max = pyo.Param(initialize=V_max)              # Max water capacity in reservoir
-    modelSub.IF_2 = pyo.Param(initialize=IF_2)                # Inflow in stage 2, stochastic
-    modelSub.v_res_guess = pyo.Param(initialize=v_res_guess)  # Guess values of what v_res is in t=24
+    modelSub.MP = pyo.Param(modelSub.T2, initialize=data.price_dict(T2))              # Market price at t
+    modelSub.WV = pyo.Param(initialize=data.WV_end)                                  # Water value at t = 48
+    modelSub.Prob = pyo.Param(modelSub.S, initialize=data.probability_dict(S))       # Probability of scenario
+    modelSub.Q_max = pyo.Param(initialize=Q_max)                                     # Max discharge of water to hydropower unit
+    modelSub.P_max = pyo.Param(initialize=P_max)                                     # Max power production of hydropower unit
+    modelSub.E_conv = pyo.Param(initialize=data.E_conv)                              # Conversion of power, p, produced pr. discarged water, q
+    modelSub.V_max = pyo.Param(initialize=V_max)                                     # Max water capacity in reservoir
+    modelSub.IF_2 = pyo.Param(modelSub.T2, modelSub.S, initialize=data.inflow_stage2_dict(S))  # Inflow in stage 2, stochastic
+    modelSub.v_res_guess = pyo.Param(initialize=0, mutable=True)  # Guess values of what v_res is in t=24, set by solve_subProblem
 
     # ---------- Declaring decision variables ----------
     modelSub.q2 = pyo.Var(modelSub.T2, modelSub.S, bounds=(0, Q_max))       # variable of discharged water from reservoir in T2 pr. scenario
@@ -126,18 +162,18 @@ def subProblem(v_res_guess, num_scenario):
     # ---------- Objective function ----------
     def objective(modelSub):
         if num_scenario == 1:
-            o2 = sum(sum(modelSub.p2[t, s] * (modelSub.MP + t) for t in modelSub.T2) for s in
+            o2 = sum(sum(modelSub.p2[t, s] * modelSub.MP[t] for t in modelSub.T2) for s in
                      modelSub.S)  # profits for T2 for the one scenario chosen to be run
-            o3 = sum(modelSub.WV * modelSub.v_res2[48, s] for s in
+            o3 = sum(modelSub.WV * modelSub.v_res2[T2[-1], s] for s in
                      modelSub.S)  # profits from Water Value * remaining reservoir level at the end of day 2
             obj = o2 + o3  # summing all profit areas
             return obj
 
         else:
-            o2 = sum(sum(modelSub.Prob * modelSub.p2[t, s] * (modelSub.MP + t) for t in modelSub.T2) for s in
+            o2 = sum(sum(modelSub.Prob[s] * modelSub.p2[t, s] * modelSub.MP[t] for t in modelSub.T2) for s in
                      modelSub.S)  # profits for T2 for each scenario * probability
-            o3 = modelSub.Prob * sum(
-                modelSub.WV * modelSub.v_res2[48, s] for s in
+            o3 = sum(
+                modelSub.Prob[s] * modelSub.WV * modelSub.v_res2[T2[-1], s] for s in
                 modelSub.S)  # profits from Water Value * remaining reservoir level at the end of day 2 * probabilities and over all scenarios
             obj = o2 + o3  # summing all profit areas
             return obj
@@ -150,57 +186,299 @@ def subProblem(v_res_guess, num_scenario):
     modelSub.constr_productionDependency2 = pyo.Constraint(modelSub.T2, modelSub.S, rule=math_production2)
 
     def math_v_res2(modelSub, t, s):  # variable dependency for production in T2
-        if t == 25:     # setting the start value of water reservoir at the start of day 2
-            return modelSub.v_res2[t, s] == modelSub.v_res_guess_var + (modelSub.IF_2 * s) - modelSub.q2[t, s]  # water reservoir = initial volume + inflow - discharge
+        if t == T2[0]:  # setting the start value of water reservoir at the start of day 2
+            return modelSub.v_res2[t, s] == modelSub.v_res_guess_var + modelSub.IF_2[t, s] - modelSub.q2[t, s]  # water reservoir = initial volume + inflow - discharge
         else:   # for the rest of time in T2
-            return modelSub.v_res2[t, s] == modelSub.v_res2[(t - 1), s] + (modelSub.IF_2 * s) - modelSub.q2[t, s]  # water reservoir = previous water level + inflow - discharge
+            return modelSub.v_res2[t, s] == modelSub.v_res2[(t - 1), s] + modelSub.IF_2[t, s] - modelSub.q2[t, s]  # water reservoir = previous water level + inflow - discharge
     modelSub.constr_math_v_res2 = pyo.Constraint(modelSub.T2, modelSub.S, rule=math_v_res2)
 
     def v_res_start(modelSub):  # constraint to explain the v_res relationship in t = 24 so we can get the dual value
         return modelSub.v_res_guess_var == modelSub.v_res_guess
     modelSub.constr_dualvalue = pyo.Constraint(rule=v_res_start)
 
-    # ---------- Initializing solver and solving the problem ----------
-    opt = SolverFactory('gurobi')
-    modelSub.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)
-    opt.solve(modelSub)
+    modelSub.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)  # to import the dual of the v_res_start constraint
+
+    return modelSub
+
+
+def solve_subProblem(modelSub, opt, v_res_guess, callback=None):
+    """
+    Function to re-solve a built subproblem for a new value of the state variable.
+    Only the right-hand side of constr_dualvalue changes, so with a persistent solver only that constraint is
+    replaced and the solver warm-starts from the previous solve
+    If a callback is given (see instrumentation.EventLog), a 'solve' event is sent with the solve time and status
+    """
+    start = time.perf_counter()
+    modelSub.v_res_guess = v_res_guess  # updating the mutable parameter with the new state value
+
+    solvers.update_constraint(opt, modelSub.constr_dualvalue)  # a persistent solver does not see parameter changes
+
     results = opt.solve(modelSub, load_solutions=True)
+    solvers.load_duals(opt, [modelSub.constr_dualvalue])  # only the dual needed for the cut is loaded
 
     obj_value = modelSub.OBJ()
     dual_value = modelSub.dual.get(modelSub.constr_dualvalue)
 
+    if callback is not None:
+        callback('solve', problem='sub', time=time.perf_counter() - start,
+                 status=results.solver.termination_condition, objective=obj_value, dual=dual_value, state=v_res_guess)
+
     return obj_value, dual_value  # returning the OBJ and dual of v_res_start constraint to be used in cut generation
 
 
-def generate_cuts(v_res_guess, OBJ, Dual, dict_of_cuts, iterator):
+def subProblem(v_res_guess, num_scenario, data=None, solver=None):
     """
-    Function to generate linear cuts and add them to the cut dictionary to be put into the master problem
+    Function to build and solve the subproblem once for the given state value.
+    Returns the Solution (see solution.py), its objective and state_dual are the OBJ and Dual to generate cuts.
+    Loops solving many states should build once and use solve_subProblem
+    """
+    modelSub = build_subProblem(num_scenario, data=data)
+
+    # ---------- Initializing solver and solving the problem ----------
+    solve_subProblem(modelSub, solvers.make_solver(solver), v_res_guess)
+    return model_solution(modelSub)
+
+
+def generate_cuts(v_res_guess, OBJ, Dual, dict_of_cuts, iterator, scenario=None):
+    """
+    Function to generate linear cuts and add them to the cut dictionary to be put into the master problem.
+    With a scenario the cut is a multi-cut for that scenario's alpha
     """
     b = OBJ - Dual * v_res_guess        # calculating value 'b' for the linear function
     cut = {'a': Dual, 'b': b}  # 'x': v_res1: trenger ikke
+    if scenario is not None:
+        cut['s'] = scenario             # the scenario the cut belongs to, for multi-cuts
     dict_of_cuts[iterator] = cut
     return
 
 
-def SDP_loop():
+def _results_to_cuts(solved, decomposed):
+    """
+    Turns the subproblem results of each guess ({guess: result}) into cuts and the guess of each cut, for the cut cache
+    """
+    dict_of_cuts, cut_states = {}, {}
+    for iterator, (guess, result) in enumerate(solved.items()):
+        if decomposed:  # one cut pr. scenario, so the weighted cut and the multi-cuts can both be made from them
+            for s, prob, OBJ, Dual in result:
+                generate_cuts(guess, OBJ, Dual, dict_of_cuts, (iterator, s), scenario=s)
+                cut_states[(iterator, s)] = guess
+        else:
+            generate_cuts(guess, result[0], result[1], dict_of_cuts, iterator)
+            cut_states[iterator] = guess
+    return dict_of_cuts, cut_states
+
+
+def _results_from_cuts(dict_of_cuts, cut_states, data):
+    """
+    Turns the cuts of the cut cache back into the subproblem results of each guess, OBJ = a * guess + b and Dual = a
+    """
+    solved = {}
+    for key, cut in dict_of_cuts.items():
+        guess = cut_states[key]
+        OBJ, Dual = cut['a'] * guess + cut['b'], cut['a']
+        if 's' in cut:
+            solved.setdefault(guess, []).append((cut['s'], float(data.probabilities[cut['s']]), OBJ, Dual))
+        else:
+            solved[guess] = (OBJ, Dual)
+    return solved
+
+
+# Every worker process in the parallel sweep owns one built subproblem and its own persistent solver
+_worker_model = {}
+
+
+def _init_sweep_worker(num_scenario, data, solver):
+    """
+    Initializer for each worker process in the parallel sweep, building the subproblem and solver once pr. worker
+    """
+    modelSub = build_subProblem(num_scenario, data=data)
+    opt = solvers.make_solver(solver, persistent=True)
+    solvers.set_instance(opt, modelSub)
+    _worker_model['model'] = modelSub
+    _worker_model['opt'] = opt
+
+
+def _solve_guess(guess):
+    """
+    Function run in the worker process, re-solving the worker's subproblem for one guess
+    """
+    return solve_subProblem(_worker_model['model'], _worker_model['opt'], guess)
+
+
+def refine_guesses(solve_guesses, to_cut, lower, upper, tolerance, max_solves=100):
+    """
+    Function to place the guesses adaptively instead of on a fixed grid.
+    Starts with the end points of [lower, upper]. Between two neighbouring guesses, the piecewise-linear approximation
+    is furthest from the true function where the two cuts intersect, so the subproblem is solved there. If the
+    approximation differs from the solved value by more than the tolerance, the point is kept and both new intervals
+    are checked in the next round. Stops when every interval is within the tolerance, or after max_solves solves.
+
+    solve_guesses solves a list of guesses and returns their subproblem results, to_cut turns one result into OBJ, Dual
+    Returns the kept guesses in increasing order, with their subproblem results
+    """
+    guesses = [lower, upper]
+    results = dict(zip(guesses, solve_guesses(guesses)))  # guess -> subproblem result
+    num_solves = len(guesses)
+    intervals = [(lower, upper)]                           # the intervals still to be checked
+
+    while intervals and num_solves < max_solves:
+        candidates = []
+        for x0, x1 in intervals:
+            OBJ0, a0 = to_cut(results[x0])
+            OBJ1, a1 = to_cut(results[x1])
+            b0, b1 = OBJ0 - a0 * x0, OBJ1 - a1 * x1
+            if abs(a0 - a1) < 1e-9:  # same slope, the function is linear between the two guesses
+                continue
+            x = min(max((b1 - b0) / (a0 - a1), x0), x1)  # the intersection of the two cuts
+            if x1 - x < 1e-6 or x - x0 < 1e-6:           # the intersection is on one of the guesses, nothing to refine
+                continue
+            candidates.append((x0, x, x1, min(a0 * x + b0, a1 * x + b1)))  # approximated value at the intersection
+
+        candidates = candidates[:max_solves - num_solves]  # not solving more than max_solves in total
+        new_results = solve_guesses([x for x0, x, x1, approx in candidates])
+        num_solves += len(candidates)
+
+        intervals = []
+        for (x0, x, x1, approx), result in zip(candidates, new_results):
+            if abs(approx - to_cut(result)[0]) > tolerance:  # the cuts are not good enough here, keeping the new guess
+                results[x] = result
+                intervals += [(x0, x), (x, x1)]
+
+    print(f'Adaptive guesses used {num_solves} subproblem solves')
+    guesses = sorted(results)
+    return guesses, [results[guess] for guess in guesses]
+
+
+def SDP_loop(decomposed=False, multi_cut=False, max_workers=None, parallel_sweep=False, adaptive=False, tolerance=1.0,
+             use_cut_pool=False, list_of_guess=None, data=None, solver=None, callback=None, cache=None):
     """
     The function to go through the Master- and Subproblem in accordance with
     the Stochastic Dynamic Programming method.
     The subproblem is run through the list of guesses as state-variables and generating cuts for each iteration. The
     number of cuts that is insertet into the master problem at the end is dependent on how many state-variable guesses that are
     run through the subproblem.
+
+    With decomposed=True each scenario is solved as its own LP on a process pool of max_workers processes,
+    and combined into the weighted cut. With multi_cut=True as well, one cut pr. scenario and guess is made instead
+    With parallel_sweep=True the guesses are solved at the same time on a process pool of max_workers processes,
+    each worker with its own solver. The cuts are still generated in the order of list_of_guess
+    With adaptive=True the guesses are placed by refine_guesses instead of list_of_guess, until the cuts are within
+    tolerance (EUR) of the subproblem everywhere in [0, V_max]
+    With use_cut_pool=True duplicate and dominated cuts are removed by a CutPool before the master problem is solved
+    list_of_guess is the state values to solve the subproblem for, by default 1-10
+    The input data is taken from data (a SystemData), by default the data of the project task
+    solver is the name of the solver to use, by default gurobi if a license is free, else an open-source solver
+    callback is called as callback(event, **fields) for every model build ('build'), subproblem and master problem
+    solve ('solve'), sweep of guesses ('sweep'), cut ('cut') and for the cut pool ('cut_pool'), e.g. an
+    instrumentation.EventLog to log them as JSON lines. Without a callback nothing extra is done
+    With a cache (a cut_cache.CutCache) the subproblem results are saved as cuts under a key of the system data after
+    every sweep of guesses, and a new run with the same data only solves the guesses that are not saved
+    Returns the Solution (see solution.py) of the master problem with the cuts, and the FutureCostFunction of the cuts
     """
-    list_of_guess = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]     # for v_res value to be put into the Subproblem
+    if data is None:
+        data = default_system_data()                    # the system data is made once and passed to every model
+    solver = solvers.select_solver(solver)              # the same solver for all the models, and the worker processes
+
+    if list_of_guess is None:
+        list_of_guess = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]  # for v_res value to be put into the Subproblem
     dict_of_cuts = {}                                   # dictionary to keep the cuts
     iterator = 0                                        # to organize the dict cut keys
     num_scenario = 5                                    # to set number of scenario's in the subproblem
-    for guess in list_of_guess:
-        OBJ, Dual = subProblem(guess, num_scenario)     # getting the OBJ and dual from v_res guess-list
+    S = data.S                                          # scenario's solved one by one in the decomposed mode
+    V_max = data.V_max                                  # Mm^3, upper bound of the guesses in the adaptive mode and cut pool
+
+    # ---------- Setting up how the subproblem is solved for a list of guesses ----------
+    pool = None
+    if decomposed:
+        pool = scenario_decomposition.create_pool(build_subProblem, solve_subProblem, max_workers, solver, data)
+
+        def solve_guesses(guesses):
+            if parallel_sweep:  # all scenario's of all guesses are sent to the pool at once
+                return scenario_decomposition.solve_scenarios_for_states(pool, S, guesses)
+            return [scenario_decomposition.solve_scenarios(pool, S, guess) for guess in guesses]
+    elif parallel_sweep:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_sweep_worker,
+                                                      initargs=(num_scenario, data, solver))
+
+        def solve_guesses(guesses):
+            return list(pool.map(_solve_guess, guesses))  # map keeps the order of the guesses
+    else:
+        start = time.perf_counter()
+        modelSub = build_subProblem(num_scenario, data=data)  # the subproblem is built once, only the guess changes
+        opt = solvers.make_solver(solver, persistent=True)  # persistent solver, warm-starts from the previous guess
+        solvers.set_instance(opt, modelSub)
+        if callback is not None:
+            callback('build', problem='sub', time=time.perf_counter() - start, solver=solver)
+
+        def solve_guesses(guesses):
+            return [solve_subProblem(modelSub, opt, guess, callback) for guess in guesses]  # the OBJ and dual of each guess
+
+    if callback is not None:  # timing each sweep of guesses, also when they are solved in the worker processes
+        solve_sweep = solve_guesses
+
+        def solve_guesses(guesses):
+            start = time.perf_counter()
+            results = solve_sweep(guesses)
+            callback('sweep', time=time.perf_counter() - start, states=list(guesses))
+            return results
+
+    if cache is not None:  # only solving the guesses not saved by an earlier run with the same data
+        cache_key = system_data_key(data, 'sdp', num_scenario, decomposed)
+        stored = cache.load(cache_key)
+        solved = _results_from_cuts(stored[0], stored[1], data) if stored is not None else {}
+        print(f'Loaded the results of {len(solved)} guesses from the cut cache')
+        solve_missing = solve_guesses
+
+        def solve_guesses(guesses):
+            missing = [guess for guess in guesses if guess not in solved]
+            if missing:
+                solved.update(zip(missing, solve_missing(missing)))
+                cache.save(cache_key, *_results_to_cuts(solved, decomposed))
+            return [solved[guess] for guess in guesses]
+
+    def to_cut(result):  # the OBJ and dual of the (probability-weighted) subproblem
+        return scenario_decomposition.combine_cut(result) if decomposed else result
+
+    # ---------- Solving the subproblem for all the guesses ----------
+    if adaptive:
+        list_of_guess, sub_results = refine_guesses(solve_guesses, to_cut, 0, V_max, tolerance)
+    else:
+        sub_results = solve_guesses(list_of_guess)
+
+    if pool is not None:
+        pool.shutdown()
 
+    # ---------- Generating the cuts in the order of the guesses ----------
+    for guess, result in zip(list_of_guess, sub_results):
         print(f'Generating cut number: {iterator}')
-        generate_cuts(guess, OBJ, Dual, dict_of_cuts, iterator)  # generating cuts from the subproblem values
-        print(f'- based on these values {dict_of_cuts[iterator]}')
+        if decomposed and multi_cut:
+            new_keys = []
+            for s, prob, OBJ, Dual in result:
+                generate_cuts(guess, OBJ, Dual, dict_of_cuts, (iterator, s), scenario=s)  # one cut pr. scenario
+                print(f'- based on these values {dict_of_cuts[(iterator, s)]}')
+                new_keys.append((iterator, s))
+        else:
+            OBJ, Dual = to_cut(result)
+            generate_cuts(guess, OBJ, Dual, dict_of_cuts, iterator)  # generating cuts from the subproblem values
+            print(f'- based on these values {dict_of_cuts[iterator]}')
+            new_keys = [iterator]
+        if callback is not None:
+            for key in new_keys:
+                callback('cut', state=guess, key=key, **dict_of_cuts[key])
         iterator += 1
 
-    print(f'Entering masterproblem with {len(list_of_guess)} cuts')
-    masterProblem(dict_of_cuts)     # solving the master problem with the cuts generated
+    if use_cut_pool:
+        cutpool = CutPool(0, V_max)
+        for key in dict_of_cuts.keys():
+            cutpool.add(key, dict_of_cuts[key])  # duplicates are not added
+        cutpool.prune()                          # removing the dominated cuts
+        print(f'The cut pool kept {len(cutpool)} of {len(dict_of_cuts)} cuts')
+        if callback is not None:
+            callback('cut_pool', cuts=len(dict_of_cuts), pool_size=len(cutpool))
+        dict_of_cuts = cutpool.to_dict()
+
+    scenario_probs = data.probability_dict() if decomposed and multi_cut else None
+    print(f'Entering masterproblem with {len(dict_of_cuts)} cuts')
+    solution = masterProblem(dict_of_cuts, scenario_probs, data, solver, callback)  # solving the master problem with the cuts generated
+
+    return solution, FutureCostFunction(dict_of_cuts, scenario_probs)  # the cuts, to evaluate the water values without the solver
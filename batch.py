@@ -0,0 +1,108 @@
+import concurrent.futures
+import os
+import time
+
+from pyomo.opt import TerminationCondition
+
+import solvers
+from model1 import build_task1_model
+from rolling_horizon import RollingHorizon
+from solution import stage1_solution
+from system_data import default_system_data
+
+
+# Every worker process keeps its solver name and its built models, these are filled by _init_worker
+_worker_setup = {}      # the solver name, and if the models are kept
+_worker_models = {}     # model key -> RollingHorizon, a task 1 model in a persistent solver, re-used for the same sizes
+
+
+def _init_worker(solver_name, reuse_models):
+    """
+    Initializer for each worker process in the pool. Pyomo is imported with this module, and the default problem
+    is solved once, so the solver library (and a Gurobi license) is loaded before the first instance arrives
+    """
+    _worker_setup['solver'] = solver_name
+    _worker_setup['reuse'] = reuse_models
+    solvers.make_solver(solver_name).solve(build_task1_model(default_system_data()))
+
+
+def _model_key(data):
+    """
+    The data that is built into the model and can not be updated: the sizes and the reservoir and plant limits.
+    Instances with the same key are solved with the same model, only the prices, inflows, probabilities and start
+    level are changed
+    """
+    return (data.inflow.shape, data.hours_stage1, data.V_max, data.Q_max, data.P_max, data.E_conv, data.WV_end)
+
+
+def _solve_instance(task):
+    """
+    Function run in the worker process, solving the task 1 problem of one instance.
+    Returns the dispatch of stage 1 as a Solution (see solution.py), with the index of the instance
+    """
+    index, data = task
+    start = time.perf_counter()
+
+    if _worker_setup['reuse']:
+        key = _model_key(data)
+        if key not in _worker_models:  # the first instance of this size, built once in a persistent solver
+            _worker_models[key] = RollingHorizon(data, step=None, solver=_worker_setup['solver'])
+        dispatch = _worker_models[key].update(data.price, data.inflow, data.probabilities, v_res=data.V_01)
+        result = {'solution': dispatch['solution']}
+    else:
+        model = build_task1_model(data)
+        results = solvers.make_solver(_worker_setup['solver']).solve(model, load_solutions=False)
+        if results.solver.termination_condition != TerminationCondition.optimal:
+            raise RuntimeError(f'No optimal solution: {results.solver.termination_condition}')
+        model.solutions.load_from(results)
+        result = {'solution': stage1_solution(model)}
+
+    result.update({'index': index, 'time': time.perf_counter() - start, 'worker': os.getpid()})
+    return result
+
+
+class BatchSolver:
+    """
+    A pool of long-lived worker processes solving many independent task 1 problems (one SystemData each, e.g. one
+    pr. plant and price area). Each worker imports Pyomo and loads the solver once, and with reuse_models=True keeps
+    the model of each problem size in a persistent solver, so an instance of a size it has seen only updates the
+    model (see RollingHorizon) instead of building it again.
+
+    The pool is kept until close() (or the end of a with block), so it can be used for several batches
+    """
+
+    def __init__(self, max_workers=None, solver=None, reuse_models=True):
+        self.solver = solvers.select_solver(solver)  # the same solver in all the workers
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                                           initargs=(self.solver, reuse_models))
+
+    def solve(self, instances, ordered=False):
+        """
+        Generator solving every instance (a SystemData) on the pool, yielding the result of each as it is done,
+        or in the order of the instances with ordered=True. Each result is a dict with the index of the instance,
+        the 'solution' (the objective and the dispatch of stage 1 as a Solution), the solve time and the worker.
+        An instance that fails gives a result with the index and the 'error' instead, the others go on
+        """
+        futures = {self.pool.submit(_solve_instance, (index, data)): index for index, data in enumerate(instances)}
+        for future in (futures if ordered else concurrent.futures.as_completed(futures)):
+            try:
+                yield future.result()
+            except Exception as error:  # e.g. an infeasible instance or a size-limited solver license
+                yield {'index': futures[future], 'error': str(error)}
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def solve_batch(instances, max_workers=None, solver=None, reuse_models=True, ordered=False):
+    """
+    Solves a list of instances on a new BatchSolver, yielding the results as they are done, see BatchSolver.solve
+    """
+    with BatchSolver(max_workers, solver, reuse_models) as batch:
+        yield from batch.solve(instances, ordered)
@@ -0,0 +1,206 @@
+import concurrent.futures
+import contextlib
+import cProfile
+import io
+import json
+import multiprocessing
+import os
+import pstats
+import resource
+import time
+
+import numpy as np
+import pyomo.environ as pyo
+
+import solvers
+from Benders import Benders_loop
+from model1 import build_task1_model
+from StochasticDP import SDP_loop
+from system_data import SystemData, M3S_TO_MM3
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+PYOMO_DIR = os.path.dirname(pyo.__file__).rsplit(os.sep, 1)[0]  # the site-packages/pyomo folder
+
+METHODS = ['extensive', 'benders', 'benders_level', 'sdp']
+
+LEVEL = 0.7  # the level of the stabilized Benders_loop, 'benders_level'
+
+# The functions Pyomo's solve() calls to write the model (the LP file of the file based interfaces, or the model
+# sent into the appsi solvers) and to read the solution back, counted as io and not as solve by _split_times
+SOLVE_IO_FUNCTIONS = ('_convert_problem', 'set_instance', 'update', 'process_soln_file', 'load_from')
+
+
+def benchmark_data(hours=48, num_scenarios=5):
+    """
+    System data of any size for the benchmark: hours hours with the price 50 + t, split in two equally long stages,
+    an inflow of 50 m^3/s in stage 1, and num_scenarios equally probable scenarios from 0 to 100 m^3/s in stage 2.
+    benchmark_data(48, 5) is the data of the project task
+    """
+    hours_array = np.arange(1, hours + 1)
+    price = 50 + hours_array                                          # Start-value of market price + t
+    scenario_inflow = np.linspace(0, 100, num_scenarios)              # m^3/s pr. scenario in stage 2
+    inflow = np.where(hours_array <= hours // 2, 50 * M3S_TO_MM3, M3S_TO_MM3 * scenario_inflow[:, None])  # Mm^3/h
+    return SystemData(price, inflow, hours_stage1=hours // 2)
+
+
+def _split_times(profile, total):
+    """
+    Splits the profiled time of a run in where it was spent, from the calls the repo code makes into Pyomo:
+    - solve: the solve() calls, the solver itself
+    - io:    writing the model for the solver and reading the solution back: the calls from solvers.py that send
+             the model to, or read the duals from, a persistent solver, and the SOLVE_IO_FUNCTIONS solve() calls
+             (the LP file of the extensive form and the SDP master problem, the model sent to an appsi solver)
+    - build: all other calls into Pyomo, building the models and adding the cuts
+    - other: the rest, the Python loops, the cut bookkeeping and the printing
+    Calls made from the constraint rules, which Pyomo itself calls while building, are already in build
+    """
+    stats = pstats.Stats(profile).stats
+    is_pyomo = {function: function[0].startswith(PYOMO_DIR) for function in stats}
+    times = {'build': 0.0, 'solve': 0.0, 'io': 0.0}
+
+    for function, (cc, nc, tt, ct, callers) in stats.items():
+        if not is_pyomo[function]:
+            continue
+        if function[2] in SOLVE_IO_FUNCTIONS:  # writing or reading inside solve(), moved from solve to io
+            for caller, (caller_cc, caller_nc, caller_tt, caller_ct) in callers.items():
+                if is_pyomo.get(caller, False) and caller[2] in ('solve', '_presolve', '_postsolve'):
+                    times['io'] += caller_ct
+                    times['solve'] -= caller_ct
+        for caller, (caller_cc, caller_nc, caller_tt, caller_ct) in callers.items():
+            if not caller[0].startswith(REPO_DIR) or caller not in stats:
+                continue
+            caller_callers = stats[caller][4]
+            if caller_callers and all(is_pyomo.get(c, False) for c in caller_callers):  # a rule called by Pyomo, already counted
+                continue
+            if function[2] == 'solve':
+                times['solve'] += caller_ct
+            elif caller[0].endswith('solvers.py'):
+                if caller[2] in ('set_instance', 'add_constraint', 'remove_constraint', 'update_constraint', 'load_duals'):
+                    times['io'] += caller_ct
+            else:
+                times['build'] += caller_ct
+
+    times['solve'] = max(times['solve'], 0.0)
+    times['other'] = max(total - sum(times.values()), 0.0)
+    return times
+
+
+def _solve_method(method, data, num_states, solver):
+    """
+    Solves the data with one of the METHODS, returns what the objective is read from and the number of iterations
+    """
+    if method == 'extensive':
+        model = build_task1_model(data)
+        solvers.make_solver(solver).solve(model)
+        return model, 1
+    if method == 'benders':
+        solution, bounds = Benders_loop(data=data, solver=solver)
+        return bounds, len(bounds)
+    if method == 'benders_level':
+        solution, bounds = Benders_loop(data=data, solver=solver, level=LEVEL)
+        return bounds, len(bounds)
+    if method == 'sdp':
+        solution, future_cost = SDP_loop(list_of_guess=list(np.linspace(0, data.V_max, num_states)), data=data,
+                                          solver=solver)
+        return solution, num_states  # one subproblem solve pr. trial state
+    raise ValueError(f'Unknown method: {method}')
+
+
+def _run_method(task):
+    """
+    Function run in a fresh worker process, solving one problem size with one method under the profiler.
+    Returns the record of the run, with the peak resident memory of the process
+    """
+    method, hours, num_scenarios, num_states, solver = task
+    data = benchmark_data(hours, num_scenarios)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # MB, after the imports
+
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # the loops print every iteration
+        result, iterations = profile.runcall(_solve_method, method, data, num_states, solver)
+    total = time.perf_counter() - start
+
+    # the objective is read outside the timed part
+    if method == 'extensive':
+        objective = result.OBJ()
+    elif method in ('benders', 'benders_level'):
+        objective = result[-1]['lower']
+    else:
+        objective = result.objective  # the master problem with the cuts, what SDP_loop prints
+
+    record = {'method': method, 'hours': hours, 'scenarios': num_scenarios,
+              'states': num_states if method == 'sdp' else None, 'solver': solver,
+              'objective': objective, 'iterations': iterations, 'total_time': total}
+    record.update({f'{key}_time': value for key, value in _split_times(profile, total).items()})
+    record['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    record['start_rss_mb'] = rss_start
+    return record
+
+
+def run_benchmark(horizons=(48, 96, 192), scenario_counts=(5, 20), state_counts=(10,), methods=None,
+                  solver=None, rel_tol=1e-3, path='benchmark_results.json'):
+    """
+    Solves every problem size (horizon length in hours x number of scenarios) with the extensive form (task1 model),
+    Benders_loop, Benders_loop with the level set stabilization (level=LEVEL) and SDP_loop (once for each number of
+    trial states in state_counts), and records for each run:
+    the time spent building the models, in the solver, and sending the model to/from the solver (see _split_times),
+    the peak resident memory (RSS), the iterations, and the objective.
+
+    Each run is made in its own fresh process, so the peak memory is of that run alone (plus the imports).
+    The times are measured under cProfile, which makes the Python parts slower, so compare the runs with each other.
+    The objectives of each size are checked against the extensive form, a difference of more than rel_tol is
+    printed and marked in the record ('agrees'). SDP only places cuts at the trial states, so it is not exact.
+
+    The records are written to path as JSON, with the time it took to write them, and returned
+    """
+    methods = METHODS if methods is None else methods
+    solver = solvers.select_solver(solver)  # the same solver for all the runs
+    spawn = multiprocessing.get_context('spawn')  # a clean process, not a copy of the memory of this one
+
+    records = []
+    for hours in horizons:
+        for num_scenarios in scenario_counts:
+            tasks = [(method, hours, num_scenarios, num_states, solver)
+                     for method in methods for num_states in (state_counts if method == 'sdp' else [None])]
+            size_records = []
+            for task in tasks:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                    try:
+                        record = pool.submit(_run_method, task).result()
+                    except Exception as error:  # e.g. a size-limited solver license, the other runs go on
+                        print(f'{task[0]:>9} {hours:>5} h {num_scenarios:>4} scenarios: failed, {error}')
+                        records.append({'method': task[0], 'hours': hours, 'scenarios': num_scenarios,
+                                        'states': task[3], 'solver': solver, 'error': str(error)})
+                        continue
+                size_records.append(record)
+                print(f"{record['method']:>9} {hours:>5} h {num_scenarios:>4} scenarios: "
+                      f"{round(record['total_time'], 3)} s (build {round(record['build_time'], 3)}, "
+                      f"solve {round(record['solve_time'], 3)}, io {round(record['io_time'], 3)}), "
+                      f"{record['iterations']} iterations, {round(record['peak_rss_mb'], 1)} MB, "
+                      f"objective {round(record['objective'], 2)}")
+
+            # ---------- Checking that the methods agree ----------
+            reference = next((r['objective'] for r in size_records if r['method'] == 'extensive'), None)
+            for record in size_records:
+                if reference is None:
+                    record['agrees'] = None
+                    continue
+                deviation = abs(record['objective'] - reference) / max(abs(reference), 1e-10)
+                record['rel_deviation'] = deviation
+                record['agrees'] = deviation <= rel_tol
+                if not record['agrees']:
+                    print(f"The objective of {record['method']} differs from the extensive form by {deviation:.2e}")
+            records += size_records
+
+    start = time.perf_counter()
+    with open(path, 'w') as file:
+        json.dump({'solver': solver, 'rel_tol': rel_tol, 'records': records}, file, indent=1)
+    print(f'Wrote {len(records)} records to {path} in {round(time.perf_counter() - start, 4)} s')
+
+    return records
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,284 @@
+import time
+
+import numpy as np
+import pyomo.environ as pyo
+from pyomo.core.expr.numeric_expr import LinearExpression
+
+import solvers
+from solution import Solution
+from system_data import default_cascade_data
+
+
+def _alpha_max(data):
+    """
+    Bound on the stage 2 profits of all the reservoirs, so alpha is never cut off
+    """
+    T1 = data.T1
+    return max(1000000, float((data.P_max * data.price[len(T1):].sum() + data.WV_end * data.V_max).sum()))
+
+
+def _add_cascade_stage(model, hours, scenarios, data, first_level):
+    """
+    Adds the variables and constraints of one stage of the cascade to model, for the hours and scenarios given
+    (scenarios is None for stage 1, which only has the inflow of scenario 0).
+    first_level(r, s) is the reservoir level before the first hour.
+    The discharge and spill of a reservoir flow into the reservoir downstream of it in the same hour, the spill
+    is water let past the turbine, so the cascade is feasible when the upstream reservoirs send more water
+    than a reservoir below can hold
+    """
+    index = [(t, r) for t in hours for r in data.R] if scenarios is None else \
+        [(t, r, s) for t in hours for r in data.R for s in scenarios]
+
+    model.q = pyo.Var(index, bounds=lambda m, t, r, *s: (0, data.Q_max[r]))      # discharge pr. hour and reservoir
+    model.p = pyo.Var(index, bounds=lambda m, t, r, *s: (0, data.P_max[r]))      # production pr. hour and reservoir
+    model.v_res = pyo.Var(index, bounds=lambda m, t, r, *s: (0, data.V_max[r]))  # reservoir level pr. hour and reservoir
+    model.spill = pyo.Var(index, bounds=(0, None))                                 # water let past the turbine
+
+    def math_production(model, t, r, *s):  # production = water discharge * power equivalent
+        return model.p[(t, r) + s] == model.q[(t, r) + s] * float(data.E_conv[r])
+    model.constr_production = pyo.Constraint(index, rule=math_production)
+
+    def math_v_res(model, t, r, *s):  # water reservoir = previous level + inflow + upstream water - discharge - spill
+        previous = first_level(r, *s) if t == hours[0] else model.v_res[(t - 1, r) + s]
+        inflow = float(data.inflow[s[0] if s else 0, r, t - 1])
+        upstream = sum(model.q[(t, u) + s] + model.spill[(t, u) + s] for u in data.upstream(r))
+        return model.v_res[(t, r) + s] == previous + inflow + upstream - model.q[(t, r) + s] - model.spill[(t, r) + s]
+    model.constr_math_v_res = pyo.Constraint(index, rule=math_v_res)
+
+
+def build_cascade_model(data=None):
+    """
+    The whole cascade problem in one model, aka the extensive form of task 1 for several reservoirs.
+    Used to check the cascade Benders loop, with one reservoir it is the task 1 model
+    The input data is taken from data (a CascadeData), by default a chain of 5 reservoirs
+    """
+    if data is None:
+        data = default_cascade_data()
+    T1, T2, S = data.T1, data.T2, data.S
+
+    model = pyo.ConcreteModel()
+    model.stage1 = pyo.Block()
+    model.stage2 = pyo.Block()
+    _add_cascade_stage(model.stage1, T1, None, data, lambda r: float(data.V_01[r]))
+    _add_cascade_stage(model.stage2, T2, S, data, lambda r, s: model.stage1.v_res[T1[-1], r])
+
+    def objective(model):
+        o1 = sum(float(data.price[t - 1]) * model.stage1.p[t, r] for t in T1 for r in data.R)   # profits for T1
+        o2 = sum(float(data.probabilities[s] * data.price[t - 1]) * model.stage2.p[t, r, s]
+                 for t in T2 for r in data.R for s in S)                                         # expected profits for T2
+        o3 = sum(float(data.probabilities[s] * data.WV_end[r]) * model.stage2.v_res[T2[-1], r, s]
+                 for r in data.R for s in S)                                                     # expected water value at the end
+        return o1 + o2 + o3
+    model.OBJ = pyo.Objective(rule=objective(model), sense=pyo.maximize)
+
+    return model
+
+
+def build_cascade_masterProblem(data=None):
+    """
+    The master problem of the cascade: the first 24 hours of all the reservoirs, and alpha for the subproblem.
+    The state is the vector of the reservoir levels in hour 24, v_res[24, r].
+    The model is built once, with an empty list of cuts, the cuts are added with add_cut_cascade_masterProblem
+    """
+    if data is None:
+        data = default_cascade_data()
+    T1 = data.T1
+
+    mastermodel = pyo.ConcreteModel()
+    _add_cascade_stage(mastermodel, T1, None, data, lambda r: float(data.V_01[r]))
+    mastermodel.alpha = pyo.Var(bounds=(-_alpha_max(data), _alpha_max(data)))  # the masterproblem's substitute for the subproblem
+
+    def objective(mastermodel):
+        return sum(float(data.price[t - 1]) * mastermodel.p[t, r] for t in T1 for r in data.R) + mastermodel.alpha
+    mastermodel.OBJ = pyo.Objective(rule=objective(mastermodel), sense=pyo.maximize)
+
+    mastermodel.state = [mastermodel.v_res[T1[-1], r] for r in data.R]  # the state variables, in the order of the cuts
+    mastermodel.listOfCuts = pyo.ConstraintList()  # filled by add_cut_cascade_masterProblem
+
+    return mastermodel
+
+
+def add_cut_cascade_masterProblem(mastermodel, a, b, opt=None):
+    """
+    Appends the cut alpha <= b + sum(a[r] * v_res[24, r]) to the master problem, a is the gradient array (R,).
+    The right-hand side is made as one LinearExpression straight from the array, not summed term by term
+    If a persistent solver is given, only the new constraint is sent to the solver
+    """
+    cut = LinearExpression(constant=float(b), linear_coefs=np.asarray(a, dtype=float).tolist(),
+                           linear_vars=mastermodel.state)
+    new_cut = mastermodel.listOfCuts.add(mastermodel.alpha <= cut)
+    if opt is not None:
+        solvers.add_constraint(opt, new_cut)
+    return new_cut
+
+
+def solve_cascade_masterProblem(mastermodel, opt):
+    """
+    (Re-)solves the master problem, returns the state, the reservoir levels in hour 24, as an array (R,)
+    """
+    opt.solve(mastermodel, load_solutions=True)
+    print(f'\nThe total objective value is: {round(mastermodel.OBJ(), 2)}')
+    return np.array([v.value for v in mastermodel.state])
+
+
+def cascade_master_solution(mastermodel, data):
+    """
+    Reads the Solution (see solution.py) of the solved master problem, with the dispatch of stage 1 as
+    (1, hours, reservoirs) arrays and the state as an array (R,)
+    """
+    T1, R = data.T1, data.R
+
+    def values(var):
+        return np.array([[var[t, r].value for r in R] for t in T1])
+
+    return Solution(mastermodel.OBJ(), T1, [0], [1.0], values(mastermodel.q), values(mastermodel.p),
+                    values(mastermodel.v_res), alpha=mastermodel.alpha.value,
+                    state=np.array([v.value for v in mastermodel.state]), reservoirs=R)
+
+
+def build_cascade_subProblem(data=None, scenarios=None):
+    """
+    The subproblem of the cascade: the last 24 hours of all the reservoirs in every scenario.
+    The start levels are the mutable parameters v_state[r], tied to v_state_var[r] by one constr_dualvalue[r]
+    pr. reservoir, so the duals give the gradient of the expected stage 2 profits in each reservoir level.
+    With scenarios (a list) only those are modelled, with their probabilities as they are
+    """
+    if data is None:
+        data = default_cascade_data()
+    T2 = data.T2
+    S = data.S if scenarios is None else scenarios
+
+    modelSub = pyo.ConcreteModel()
+    modelSub.R = pyo.Set(initialize=data.R)
+    modelSub.v_state = pyo.Param(modelSub.R, initialize=0, mutable=True)             # the state from the master problem, set by solve_cascade_subProblem
+    modelSub.v_state_var = pyo.Var(modelSub.R, bounds=lambda m, r: (0, data.V_max[r]))  # complicating variables, v_res[24, r]
+    _add_cascade_stage(modelSub, T2, S, data, lambda r, s: modelSub.v_state_var[r])
+
+    def objective(modelSub):
+        o2 = sum(float(data.probabilities[s] * data.price[t - 1]) * modelSub.p[t, r, s]
+                 for t in T2 for r in data.R for s in S)                                 # expected profits for T2
+        o3 = sum(float(data.probabilities[s] * data.WV_end[r]) * modelSub.v_res[T2[-1], r, s]
+                 for r in data.R for s in S)                                             # expected water value at the end
+        return o2 + o3
+    modelSub.OBJ = pyo.Objective(rule=objective(modelSub), sense=pyo.maximize)
+
+    def v_res_start(modelSub, r):  # one constraint pr. reservoir, to get the dual of each state
+        return modelSub.v_state_var[r] == modelSub.v_state[r]
+    modelSub.constr_dualvalue = pyo.Constraint(modelSub.R, rule=v_res_start)
+
+    modelSub.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)
+
+    return modelSub
+
+
+def solve_cascade_subProblem(modelSub, opt, state):
+    """
+    Re-solves the subproblem for a new state (R,). Returns the objective and the duals of constr_dualvalue as an
+    array (R,), the gradient of the cut
+    """
+    constraints = [modelSub.constr_dualvalue[r] for r in modelSub.R]
+    for r, constraint in zip(modelSub.R, constraints):
+        if modelSub.v_state[r].value != state[r]:  # only the changed states are sent to a persistent solver
+            modelSub.v_state[r] = float(state[r])
+            solvers.update_constraint(opt, constraint)
+
+    opt.solve(modelSub, load_solutions=True)
+    solvers.load_duals(opt, constraints)
+    return modelSub.OBJ(), np.array([modelSub.dual.get(constraint) for constraint in constraints])
+
+
+class CascadeCuts:
+    """
+    The cuts of the cascade as arrays, a (K, R) with the gradient of each cut and b (K,), aka alpha <= b + a @ v.
+    A cut equal to one already stored (within tol) is not added again, and the future cost of many states is
+    evaluated at once with one matrix product
+    """
+
+    def __init__(self, num_reservoirs, tol=1e-9):
+        self.a = np.empty((0, num_reservoirs))
+        self.b = np.empty(0)
+        self.tol = tol
+
+    def __len__(self):
+        return len(self.b)
+
+    def add(self, OBJ, dual, state):
+        """
+        Makes the cut through (state, OBJ) with the gradient dual, returns (a, b), or None if it is already stored
+        """
+        a = np.asarray(dual, dtype=float)
+        b = float(OBJ - a @ np.asarray(state, dtype=float))  # calculating value 'b' for the linear function
+        if len(self) and np.any(np.all(np.abs(self.a - a) <= self.tol, axis=1) & (np.abs(self.b - b) <= self.tol)):
+            return None
+        self.a = np.vstack([self.a, a])
+        self.b = np.append(self.b, b)
+        return a, b
+
+    def evaluate(self, states):
+        """
+        The future cost function (the lowest cut) in the states, (N, R) or (R,)
+        """
+        states = np.asarray(states, dtype=float)
+        return (states @ self.a.T + self.b).min(axis=-1)
+
+    def to_dict(self):
+        """
+        The cuts in the dict_of_cuts format, with the gradient array as 'a'
+        """
+        return {k: {'a': self.a[k], 'b': float(self.b[k])} for k in range(len(self))}
+
+
+def cascade_Benders_loop(data=None, max_iterations=100, rel_gap=1e-6, solver=None):
+    """
+    Benders decomposition of the cascade, like Benders_loop with a vector state: the master problem returns the
+    reservoir levels in hour 24, the subproblem returns the objective and one dual pr. reservoir, and the cut
+    alpha <= b + a @ v is added to the master problem.
+    Stops when the gap between the upper bound (master objective) and the lower bound (stage 1 profit + the true
+    expected value of the subproblem) is within rel_gap, or after max_iterations.
+    Returns the Solution of the master problem with all the cuts (see cascade_master_solution), the bounds of
+    each iteration and the CascadeCuts
+    """
+    if data is None:
+        data = default_cascade_data()
+    solver = solvers.select_solver(solver)
+
+    modelSub = build_cascade_subProblem(data)  # built once, only the states change
+    opt_sub = solvers.make_solver(solver, persistent=True)
+    solvers.set_instance(opt_sub, modelSub)
+
+    mastermodel = build_cascade_masterProblem(data)
+    opt = solvers.make_solver(solver, persistent=True)
+    solvers.set_instance(opt, mastermodel)
+
+    cuts = CascadeCuts(len(data.R))
+    bounds = []
+    lower_bound = -float('inf')
+    start_time = time.perf_counter()
+
+    for iteration in range(1, max_iterations + 1):
+        print(f'Master problem iteration nr: {iteration}')
+        state = solve_cascade_masterProblem(mastermodel, opt)
+        upper_bound = mastermodel.OBJ()
+        first_stage_profit = mastermodel.OBJ() - mastermodel.alpha.value
+
+        OBJ, dual = solve_cascade_subProblem(modelSub, opt_sub, state)
+        cut = cuts.add(OBJ, dual, state)
+        if cut is not None:
+            add_cut_cascade_masterProblem(mastermodel, *cut, opt)
+
+        # ---------- Checking convergence ----------
+        lower_bound = max(lower_bound, first_stage_profit + OBJ)
+        gap = upper_bound - lower_bound
+        bounds.append({'iteration': iteration, 'upper': upper_bound, 'lower': lower_bound, 'gap': gap,
+                       'time': time.perf_counter() - start_time})
+        print(f'Upper bound: {round(upper_bound, 2)}, lower bound: {round(lower_bound, 2)}, gap: {round(gap, 4)}')
+
+        if gap <= rel_gap * max(abs(lower_bound), 1e-10):
+            print(f'Converged after {iteration} iterations')
+            break
+        if cut is None:  # the same cut again, the master problem will not move
+            print(f'No new cut after {iteration} iterations')
+            break
+
+    solve_cascade_masterProblem(mastermodel, opt)  # the dispatch with the cut of the last iteration
+    return cascade_master_solution(mastermodel, data), bounds, cuts
@@ -0,0 +1,93 @@
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+
+def system_data_key(data, *options):
+    """
+    The key of the cuts of one problem: a hash of all the system data, and the options that change the cuts
+    (e.g. the method, and if the scenarios are decomposed). The same data gives the same key in every run
+    """
+    digest = hashlib.sha256()
+    for array in (data.price, data.inflow, data.probabilities):
+        digest.update(str(array.shape).encode())
+        digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    values = (data.hours_stage1, data.V_max, data.V_01, data.Q_max, data.P_max, data.E_conv, data.WV_end) + options
+    digest.update(repr(values).encode())
+    return digest.hexdigest()[:32]
+
+
+class CutCache:
+    """
+    Cuts stored on disk between the runs, one NumPy .npz file pr. key (see system_data_key) in directory.
+    Each file has the cuts in the dict_of_cuts format as arrays: the key of each cut (its iteration or guess number),
+    the scenario (-1 for a weighted cut), the slope a, the intercept b and the state the cut was made in,
+    together with the last saved iteration, lower bound and the state of the best solution (the center of the
+    level set of Benders_loop(level=...)), so a stopped run can go on from there.
+
+    When there are more than max_entries files, the least recently used ones are deleted
+    """
+
+    def __init__(self, directory='cut_cache', max_entries=20):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def load(self, key):
+        """
+        Returns dict_of_cuts, the state of each cut ({cut key: state}) and the saved iteration, lower bound and
+        center (None if not saved), or None if there are no cuts for the key
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as npz:
+            entry = {name: npz[name] for name in npz.files}
+        os.utime(path)  # marking the file as used, for the LRU eviction
+
+        dict_of_cuts, cut_states = {}, {}
+        for number, s, a, b, state in zip(entry['key'], entry['scenario'], entry['a'], entry['b'], entry['state']):
+            if s < 0:
+                key_cut, cut = int(number), {'a': float(a), 'b': float(b)}
+            else:
+                key_cut, cut = (int(number), int(s)), {'a': float(a), 'b': float(b), 's': int(s)}
+            dict_of_cuts[key_cut] = cut
+            cut_states[key_cut] = float(state)
+        center = float(entry['center']) if 'center' in entry and not np.isnan(entry['center']) else None
+        return dict_of_cuts, cut_states, int(entry['iteration']), float(entry['lower_bound']), center
+
+    def save(self, key, dict_of_cuts, cut_states, iteration=0, lower_bound=-np.inf, center=None):
+        """
+        Saves the cuts of the key, replacing the saved ones. The file is written to a temporary file first and then
+        renamed, so a run stopped while saving leaves the last complete file
+        """
+        keys = list(dict_of_cuts)
+        path = self._path(key)
+        temporary = path + '.tmp.npz'
+        np.savez(temporary,
+                 key=np.array([k[0] if isinstance(k, tuple) else k for k in keys], dtype=np.int64),
+                 scenario=np.array([dict_of_cuts[k].get('s', -1) for k in keys], dtype=np.int64),
+                 a=np.array([dict_of_cuts[k]['a'] for k in keys], dtype=float),
+                 b=np.array([dict_of_cuts[k]['b'] for k in keys], dtype=float),
+                 state=np.array([cut_states[k] for k in keys], dtype=float),
+                 iteration=iteration, lower_bound=lower_bound, center=np.nan if center is None else center)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used files when there are more than max_entries
+        """
+        paths = sorted(glob.glob(os.path.join(self.directory, '*.npz')), key=os.path.getmtime)
+        paths = [path for path in paths if not path.endswith('.tmp.npz')]
+        for path in paths[:max(len(paths) - self.max_entries, 0)]:
+            os.remove(path)
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.directory, '*.npz')):
+            os.remove(path)
@@ -0,0 +1,135 @@
+import numpy as np
+
+
+def _lower_envelope(a, b, lower, upper):
+    """
+    The positions of the lines a * x + b that are the lowest somewhere in [lower, upper], in O(K log K) time.
+    Going from the steepest to the flattest slope, each line is the lowest to the right of where it crosses the
+    line before it, so a line whose crossing with the next one is not to the right of its own crossing is never
+    the lowest and is taken off the stack (the convex hull of the lines). Of parallel lines only the lowest is kept
+    """
+    order = np.lexsort((b, -a))     # slope from high to low, and the lowest intercept first for the same slope
+    hull, starts = [], []           # the lines of the envelope, and the x where each becomes the lowest
+    for i in order:
+        if hull and a[hull[-1]] == a[i]:
+            continue                # parallel to a lower line
+        start = -np.inf
+        while hull:
+            j = hull[-1]
+            start = (b[i] - b[j]) / (a[j] - a[i])   # where line i crosses the last line of the envelope
+            if start > starts[-1]:
+                break
+            hull.pop()
+            starts.pop()
+            start = -np.inf
+        if start >= upper:
+            continue                # only the lowest to the right of the state range
+        hull.append(i)
+        starts.append(start)
+
+    # the lines that stop being the lowest at or before the lower bound
+    first = np.searchsorted(starts, lower, side='right') - 1
+    return np.array(hull[max(first, 0):], dtype=int)
+
+
+class CutPool:
+    """
+    The cuts of dict_of_cuts stored as NumPy arrays of slopes 'a' and intercepts 'b', for the state v_res1[24] in
+    [lower, upper]. Keeps the pool small by rejecting duplicates, pruning cuts that are dominated over the whole state
+    range, and (with max_age) retiring cuts that have not been binding in the master problem for max_age iterations.
+
+    A cut with a scenario 's' (multi-cut) is only compared with the cuts of the same scenario
+    """
+
+    def __init__(self, lower, upper, tolerance=1e-6, max_age=None):
+        self.lower = lower              # lower bound of the state variable
+        self.upper = upper              # upper bound of the state variable
+        self.tolerance = tolerance      # EUR, cuts closer than this are seen as equal
+        self.max_age = max_age          # iterations a cut can be non-binding before it is retired, None to keep all
+
+        self.keys = []                  # the dict_of_cuts key of each cut
+        self.scenarios = []             # the scenario of each cut, None for the weighted cuts
+        self.a = np.empty(0)            # slope of each cut
+        self.b = np.empty(0)            # intercept of each cut
+        self.age = np.empty(0, dtype=int)  # iterations since each cut was binding
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _same_scenario(self, scenario):
+        return np.array([s == scenario for s in self.scenarios], dtype=bool)
+
+    def add(self, key, cut):
+        """
+        Adds a cut from generate_cuts to the pool.
+        Returns False if the cut is a duplicate (within tolerance at both state bounds) of a cut already in the pool
+        """
+        scenario = cut.get('s')
+        same = self._same_scenario(scenario)
+        if same.any():  # two lines within tolerance at both bounds are within tolerance on the whole range
+            diff_lower = np.abs(self.a[same] * self.lower + self.b[same] - (cut['a'] * self.lower + cut['b']))
+            diff_upper = np.abs(self.a[same] * self.upper + self.b[same] - (cut['a'] * self.upper + cut['b']))
+            if np.any((diff_lower <= self.tolerance) & (diff_upper <= self.tolerance)):
+                return False
+
+        self.keys.append(key)
+        self.scenarios.append(scenario)
+        self.a = np.append(self.a, cut['a'])
+        self.b = np.append(self.b, cut['b'])
+        self.age = np.append(self.age, 0)
+        return True
+
+    def _remove(self, mask):
+        """
+        Removes the cuts where mask is True, returns their keys
+        """
+        removed = [key for key, m in zip(self.keys, mask) if m]
+        keep = ~mask
+        self.keys = [key for key, k in zip(self.keys, keep) if k]
+        self.scenarios = [s for s, k in zip(self.scenarios, keep) if k]
+        self.a, self.b, self.age = self.a[keep], self.b[keep], self.age[keep]
+        return removed
+
+    def prune(self):
+        """
+        Removes the cuts that are dominated over [lower, upper], returns their keys.
+        alpha is bounded by the lowest cut, so only the cuts on the lower envelope of the lines are kept,
+        see _lower_envelope
+        """
+        dominated = np.zeros(len(self.keys), dtype=bool)
+        for scenario in set(self.scenarios):
+            idx = np.flatnonzero(self._same_scenario(scenario))
+            on_envelope = np.zeros(len(idx), dtype=bool)
+            on_envelope[_lower_envelope(self.a[idx], self.b[idx], self.lower, self.upper)] = True
+            dominated[idx] = ~on_envelope
+
+        return self._remove(dominated)
+
+    def update_ages(self, x, alpha):
+        """
+        Ages the cuts after a master problem solve with state x.
+        alpha is the value of alpha, or a dict {scenario: alpha_s} for multi-cut. A cut is binding if it is within
+        tolerance of its alpha. Returns the keys of the cuts retired for being non-binding more than max_age iterations
+        """
+        if isinstance(alpha, dict):
+            alpha_values = np.array([alpha[s] for s in self.scenarios])
+        else:
+            alpha_values = np.full(len(self.keys), alpha)
+
+        binding = self.a * x + self.b - alpha_values <= self.tolerance
+        self.age = np.where(binding, 0, self.age + 1)
+
+        if self.max_age is None:
+            return []
+        return self._remove(self.age > self.max_age)
+
+    def to_dict(self):
+        """
+        Returns the cuts in the pool in the dict_of_cuts format of generate_cuts
+        """
+        dict_of_cuts = {}
+        for key, scenario, a, b in zip(self.keys, self.scenarios, self.a, self.b):
+            dict_of_cuts[key] = {'a': float(a), 'b': float(b)}
+            if scenario is not None:
+                dict_of_cuts[key]['s'] = scenario
+        return dict_of_cuts
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class FutureCostFunction:
+    """
+    The future cost function (the expected profit of the last 24 hours) approximated by the cuts in dict_of_cuts,
+    alpha(x) = min_k(a_k * x + b_k), evaluated for whole NumPy arrays of reservoir levels x without the LP solver.
+
+    Multi-cuts (cuts with a scenario 's') are evaluated pr. scenario and weighted with scenario_probs
+    """
+
+    def __init__(self, dict_of_cuts, scenario_probs=None):
+        if not dict_of_cuts:
+            raise ValueError('The future cost function needs at least one cut')
+
+        if scenario_probs is None:
+            scenario_probs = {None: 1.0}  # the weighted cuts, all in one group
+
+        self.scenarios = list(scenario_probs)                                  # one group of cuts pr. scenario
+        self.probs = np.array([scenario_probs[s] for s in self.scenarios])
+        self.keys = [[key for key in dict_of_cuts if dict_of_cuts[key].get('s') == s] for s in self.scenarios]
+        self.a = [np.array([dict_of_cuts[key]['a'] for key in keys]) for keys in self.keys]   # slopes pr. scenario
+        self.b = [np.array([dict_of_cuts[key]['b'] for key in keys]) for keys in self.keys]   # intercepts pr. scenario
+
+        for s, keys in zip(self.scenarios, self.keys):
+            if not keys:
+                raise ValueError(f'No cuts for scenario {s}')
+
+    def evaluate(self, x):
+        """
+        Evaluates the future cost function at the reservoir levels x (a number or an array).
+        Returns the value, the index of the active cut, and the slope (the marginal water value, EUR/Mm^3).
+        The active index is into self.keys[0], or an array with one row pr. scenario for multi-cuts
+        """
+        x = np.asarray(x, dtype=float)
+        value = np.zeros(x.shape)
+        slope = np.zeros(x.shape)
+        active = []
+
+        for prob, a, b in zip(self.probs, self.a, self.b):
+            values = a.reshape((-1,) + (1,) * x.ndim) * x + b.reshape((-1,) + (1,) * x.ndim)  # cuts along axis 0
+            idx = values.argmin(axis=0)             # the lowest cut is the one bounding alpha
+            value += prob * np.take_along_axis(values, idx[None], axis=0)[0]
+            slope += prob * a[idx]
+            active.append(idx)
+
+        active = active[0] if len(active) == 1 else np.stack(active)
+        return value, active, slope
+
+    def water_value(self, x):
+        """
+        Returns the marginal water value (EUR/Mm^3) at the reservoir levels x
+        """
+        return self.evaluate(x)[2]
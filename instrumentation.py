@@ -0,0 +1,49 @@
+import json
+import sys
+import time
+
+
+class EventLog:
+    """
+    A callback for Benders_loop and SDP_loop writing every event as one line of JSON, aka a JSON-lines log.
+    Each line has the event name, the time stamp and the fields of the event, e.g.
+    {"event": "solve", "time_stamp": 1700000000.0, "problem": "sub", "time": 0.0021, "status": "optimal", ...}
+
+    path is the file to append the events to, by default they are written to stdout.
+    The loops only call the callback when one is given, so without it nothing is timed or written
+    """
+
+    def __init__(self, path=None):
+        self.file = sys.stdout if path is None else open(path, 'a')
+
+    def __call__(self, event, **fields):
+        record = {'event': event, 'time_stamp': time.time(), **fields}
+        self.file.write(json.dumps(record, default=_to_json) + '\n')
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _to_json(value):
+    """
+    Converts the values json does not know, NumPy numbers to Python numbers, the rest (e.g. solver statuses) to text
+    """
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def read_events(path, event=None):
+    """
+    Reads the events of a JSON-lines log back as a list of dicts, only the ones named event if given
+    """
+    with open(path) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    return [record for record in records if event is None or record['event'] == event]
@@ -0,0 +1,216 @@
+import numpy as np
+import scipy.sparse as sp
+
+from solution import Solution
+from system_data import default_system_data
+
+
+class LPMatrices:
+    """
+    A linear problem on matrix form: maximize c @ x, subject to A @ x == b and lower <= x <= upper.
+    columns maps each variable name ('q1', 'p2', ...) to {index: column}, rows maps each constraint name to {index: row}
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.rows = {}
+        self.n_columns = 0
+        self.n_rows = 0
+        self._c, self._lower, self._upper = [], [], []
+        self._A_rows, self._A_cols, self._A_values, self._b = [], [], [], []
+
+    def add_variable(self, name, index, lower, upper, cost=None):
+        """
+        Adds one column pr. element of index, returns the column numbers as an array
+        """
+        columns = np.arange(self.n_columns, self.n_columns + len(index))
+        self.columns[name] = dict(zip(index, columns))
+        self.n_columns += len(index)
+        self._c.append(np.zeros(len(index)) if cost is None else np.asarray(cost, dtype=float))
+        self._lower.append(np.full(len(index), lower, dtype=float))
+        self._upper.append(np.full(len(index), upper, dtype=float))
+        return columns
+
+    def add_constraint(self, name, index, terms, rhs):
+        """
+        Adds one equality row pr. element of index. terms is a list of (coefficient, columns), with one column pr. row
+        (or -1 for no variable in that row), so sum(coefficient * x[columns]) == rhs for every row
+        """
+        rows = np.arange(self.n_rows, self.n_rows + len(index))
+        self.rows[name] = dict(zip(index, rows))
+        self.n_rows += len(index)
+        for coefficient, columns in terms:
+            columns = np.asarray(columns)
+            used = columns >= 0  # -1 marks a row without this term
+            self._A_rows.append(rows[used])
+            self._A_cols.append(columns[used])
+            self._A_values.append(np.broadcast_to(np.asarray(coefficient, dtype=float), rows.shape)[used])
+        self._b.append(np.asarray(rhs, dtype=float) * np.ones(len(index)))
+        return rows
+
+    def matrices(self):
+        """
+        Returns c, A (scipy CSR), b, lower and upper
+        """
+        A = sp.csr_matrix((np.concatenate(self._A_values), (np.concatenate(self._A_rows), np.concatenate(self._A_cols))),
+                          shape=(self.n_rows, self.n_columns))
+        return (np.concatenate(self._c), A, np.concatenate(self._b),
+                np.concatenate(self._lower), np.concatenate(self._upper))
+
+
+def _add_stage2(lp, data, S, weights, v_start):
+    """
+    Adds the variables and constraints of hour 25-48 for the scenarios S to lp.
+    v_start is the column of the reservoir level at t=24, v_res1[24] or the state of the subproblem
+    """
+    T2 = data.T2
+    index = [(t, s) for s in S for t in T2]          # scenario-major, so the hours of a scenario are next to each other
+    t_idx = np.array([t for t, s in index]) - 1
+    s_idx = np.array([s for t, s in index])
+    weight = np.array([weights[s] for t, s in index])
+    last = t_idx == T2[-1] - 1
+    first = t_idx == T2[0] - 1
+
+    q2 = lp.add_variable('q2', index, 0, data.Q_max)
+    p2 = lp.add_variable('p2', index, 0, data.P_max, cost=weight * data.price[t_idx])  # profits for T2 * probability
+    v2 = lp.add_variable('v_res2', index, 0, data.V_max, cost=np.where(last, weight * data.WV_end, 0))  # water value
+
+    lp.add_constraint('constr_productionDependency2', index, [(1, p2), (-data.E_conv, q2)], 0)
+
+    previous = np.where(first, -1, v2 - 1)  # v_res2[t-1, s], the column before in the same scenario
+    start = np.where(first, v_start, -1)    # v_res[24] in the first hour of day 2
+    lp.add_constraint('constr_math_v_res2', index, [(1, v2), (-1, previous), (-1, start), (1, q2)],
+                      data.inflow[s_idx, t_idx])
+
+
+def build_task1_matrices(data=None):
+    """
+    The same problem as build_task1_model, assembled straight into sparse matrices without Pyomo expressions
+    """
+    if data is None:
+        data = default_system_data()
+    lp = LPMatrices()
+
+    T1 = data.T1
+    t_idx = np.array(T1) - 1
+    q1 = lp.add_variable('q1', T1, 0, data.Q_max)
+    p1 = lp.add_variable('p1', T1, 0, data.P_max, cost=data.price[t_idx])  # profits for T1
+    v1 = lp.add_variable('v_res1', T1, 0, data.V_max)
+
+    lp.add_constraint('constr_productionDependency1', T1, [(1, p1), (-data.E_conv, q1)], 0)
+    rhs = data.inflow[0, t_idx].copy()
+    rhs[0] += data.V_01  # initial volume in the first hour
+    lp.add_constraint('constr_math_v_res1', T1, [(1, v1), (-1, np.r_[-1, v1[:-1]]), (1, q1)], rhs)
+
+    _add_stage2(lp, data, data.S, data.probability_dict(), v_start=v1[-1])
+    return lp
+
+
+def build_subProblem_matrices(v_res_t24, num_scenario, data=None):
+    """
+    The same problem as build_subProblem, assembled straight into sparse matrices. Like there, the reservoir level
+    at t=24 is the column v_res_t24_var bounded to [0, V_max], fixed to v_res_t24 by the constr_dualvalue row, so
+    the dual of that row (the slope of the cut) is the same as from build_subProblem with the same solver, also at
+    the bounds (where the dual is not unique, so two solvers can give different ones)
+    """
+    if data is None:
+        data = default_system_data()
+    lp = LPMatrices()
+
+    if num_scenario == 1:  # one scenario, not weighted, like build_subProblem
+        S, weights = [2], {2: 1.0}
+    else:
+        S, weights = data.S, data.probability_dict()
+
+    v_start = lp.add_variable('v_res_t24_var', [0], 0, data.V_max)  # complicating variable, v_res[24] from the master problem
+    lp.add_constraint('constr_dualvalue', [0], [(1, v_start)], v_res_t24)
+    _add_stage2(lp, data, S, weights, v_start=v_start[0])
+    return lp
+
+
+def solve_matrices(lp, solver='highs'):
+    """
+    Solves the matrix problem with the matrix API of the solver, 'highs' (through scipy) or 'gurobi' (gurobipy).
+    Returns the objective value, the primal values and the duals (d objective / d b), as NumPy arrays
+    """
+    c, A, b, lower, upper = lp.matrices()
+
+    if solver == 'highs':
+        from scipy.optimize import linprog
+        result = linprog(-c, A_eq=A, b_eq=b, bounds=np.column_stack([lower, upper]), method='highs')
+        if result.status != 0:
+            raise RuntimeError(f'HiGHS could not solve the problem: {result.message}')
+        return -result.fun, result.x, -result.eqlin.marginals  # maximizing -c, so the signs are turned
+
+    if solver == 'gurobi':
+        import gurobipy as gp
+        model = gp.Model()
+        model.Params.OutputFlag = 0
+        x = model.addMVar(len(c), lb=lower, ub=upper, obj=c)
+        constraints = model.addMConstr(A, x, '=', b)
+        model.ModelSense = gp.GRB.MAXIMIZE
+        model.optimize()
+        if model.Status != gp.GRB.OPTIMAL:
+            raise RuntimeError(f'Gurobi could not solve the problem, status {model.Status}')
+        return model.ObjVal, x.X, constraints.Pi
+
+    raise ValueError(f'Unknown matrix solver: {solver}')
+
+
+def named_values(lp, values, names):
+    """
+    Maps a solution array back to the names of the Pyomo models, {name: {index: value}}
+    """
+    mapping = {**lp.columns, **lp.rows}
+    return {name: {index: float(values[i]) for index, i in mapping[name].items()} for name in names}
+
+
+def _block(mapping, values, shape):
+    """
+    The values of one variable or constraint (its {index: column or row} mapping) as an array of the shape.
+    The columns and rows of each name are numbered one after the other, so this is a slice of values, not a copy
+    """
+    first = next(iter(mapping.values()))
+    return values[first:first + len(mapping)].reshape(shape)
+
+
+def task1_model_matrix(data=None, solver='highs'):
+    """
+    Solves the problem of task1_model through the matrix builder.
+    Returns the Solution (see solution.py), with the duals of the reservoir balances
+    """
+    if data is None:
+        data = default_system_data()
+    lp = build_task1_matrices(data)
+    OBJ, x, duals = solve_matrices(lp, solver)
+
+    OBJ_value = round(OBJ, 2)  # rounding to two decimal points
+    print(f'\nThe total objective value is: {OBJ_value}')
+
+    T1, T2, S = len(data.T1), len(data.T2), len(data.S)
+    stage1 = [_block(lp.columns[name], x, (1, T1)) for name in ('q1', 'p1', 'v_res1')]
+    stage2 = [_block(lp.columns[name], x, (S, T2)) for name in ('q2', 'p2', 'v_res2')]  # scenario-major columns
+    q, p, v_res = (np.hstack([np.broadcast_to(one, (S, T1)), two]) for one, two in zip(stage1, stage2))
+    balance_dual = np.hstack([np.broadcast_to(_block(lp.rows['constr_math_v_res1'], duals, (1, T1)), (S, T1)),
+                              _block(lp.rows['constr_math_v_res2'], duals, (S, T2))])
+
+    return Solution(OBJ, data.T1 + data.T2, data.S, data.probabilities, q, p, v_res, balance_dual,
+                    state=float(stage1[2][0, -1]))
+
+
+def subProblem_matrix(v_res_t24, num_scenario, data=None, solver='highs'):
+    """
+    Solves the subproblem through the matrix builder, returns the Solution like subProblem, with the dual of
+    constr_dualvalue as the state dual
+    """
+    if data is None:
+        data = default_system_data()
+    lp = build_subProblem_matrices(v_res_t24, num_scenario, data)
+    OBJ, x, duals = solve_matrices(lp, solver)
+
+    S = [2] if num_scenario == 1 else data.S  # the scenarios of build_subProblem_matrices
+    shape = (len(S), len(data.T2))
+    balance_dual = _block(lp.rows['constr_math_v_res2'], duals, shape)
+    return Solution(OBJ, data.T2, S, data.probabilities[S], *(_block(lp.columns[name], x, shape)
+                                                               for name in ('q2', 'p2', 'v_res2')),
+                    balance_dual, state=float(v_res_t24), state_dual=float(duals[lp.rows['constr_dualvalue'][0]]))
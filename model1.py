@@ -1,28 +1,30 @@
 import pyomo.environ as pyo
-from pyomo.opt import SolverFactory
 
+from solution import model_solution
+from solvers import make_solver
+from system_data import default_system_data
 
-def task1_model():
+
+def build_task1_model(data=None, mutable=False):
     """
-    The complete optimization model of the hydropower scheduling problem
+    The complete optimization model of the hydropower scheduling problem.
+    The input data is taken from data (a SystemData), by default the data of the project task
+    With mutable=True the model can be re-solved for new forecasts without building it again (see rolling_horizon.py):
+    the prices and probabilities are mutable parameters, and the inflows and the initial level are variables with
+    both bounds at the value, so a persistent solver only has to change their bounds, not the constraints
     """
+    if data is None:
+        data = default_system_data()
+
     # Set data
-    T1 = list(range(1, 25))      # Hour 1-24, day 1
-    T2 = list(range(25, 49))     # Hour 25-48, day 2
-    S = list(range(0, 5))        # Scenario 0-4
+    T1 = data.T1                 # Hour 1-24, day 1
+    T2 = data.T2                 # Hour 25-48, day 2
+    S = data.S                   # Scenario 0-4
 
     # Parameters data
-    M3S_TO_MM3 = 3.6/1000        # Convesion factor to MM^3
-    MP = 50                      # Start-value of market price
-    WV_end = 13000               # EUR/Mm^3
-    prob = 0.2                   # 1/5 pr scenario
-    Q_max = 100 * M3S_TO_MM3     # Mm^3
-    P_max = 100                  # MW (over 1 hour)
-    E_conv = 0.981 / M3S_TO_MM3  # MWh/Mm^3
-    V_max = 10                   # Mm^3
-    IF_1 = 50 * M3S_TO_MM3       # Mm^3/h, Inflow Stage 1
-    IF_2 = 25 * M3S_TO_MM3       # Mm^3/h, Inflow Stage 2
-    V_01 = 5                     # Mm^3, initial water level, Stage 1
+    Q_max = data.Q_max           # Mm^3
+    P_max = data.P_max           # MW (over 1 hour)
+    V_max = data.V_max           # Mm^3
 
     model = pyo.ConcreteModel('Task 1')
 
@@ -32,16 +34,22 @@ def task1_model():
     model.S = pyo.Set(initialize=S)     # Scenarios, s
 
     # ---------- Declaring parameters ----------
-    model.MP = pyo.Param(initialize=MP)                 # Market price at t
-    model.WV = pyo.Param(initialize=WV_end)             # Water value at t = 48
-    model.Prob = pyo.Param(initialize=prob)             # Probability of scenario
-    model.Q_max = pyo.Param(initialize=Q_max)           # Max discharge of water to hydropower unit
-    model.P_max = pyo.Param(initialize=P_max)           # Max power production of hydropower unit
-    model.E_conv = pyo.Param(initialize=E_conv)         # Conversion of power, p, produced pr. discarged water, q
-    model.V_max = pyo.Param(initialize=V_max)           # Max water capacity in reservoir
-    model.IF_1 = pyo.Param(initialize=IF_1)             # Inflow in stage 1, deterministic
-    model.IF_2 = pyo.Param(initialize=IF_2)             # Inflow in stage 2, stochastic
-    model.V_01 = pyo.Param(initialize=V_01)             # Initial water level t = 1
+    model.MP = pyo.Param(T1 + T2, initialize=data.price_dict(T1 + T2), mutable=mutable)  # Market price at t
+    model.WV = pyo.Param(initialize=data.WV_end)                            # Water value at t = 48
+    model.Prob = pyo.Param(model.S, initialize=data.probability_dict(), mutable=mutable)  # Probability of scenario
+    model.Q_max = pyo.Param(initialize=Q_max)                               # Max discharge of water to hydropower unit
+    model.P_max = pyo.Param(initialize=P_max)                               # Max power production of hydropower unit
+    model.E_conv = pyo.Param(initialize=data.E_conv)                        # Conversion of power, p, produced pr. discarged water, q
+    model.V_max = pyo.Param(initialize=V_max)                               # Max water capacity in reservoir
+    if not mutable:
+        model.IF_1 = pyo.Param(model.T1, initialize=data.inflow_stage1_dict())  # Inflow in stage 1, deterministic
+        model.IF_2 = pyo.Param(model.T2, model.S, initialize=data.inflow_stage2_dict())  # Inflow in stage 2, stochastic
+        model.V_01 = pyo.Param(initialize=data.V_01)                            # Initial water level t = 1
+    else:  # the same values as variables bounded to the value, updated through the bounds
+        IF_1, IF_2 = data.inflow_stage1_dict(), data.inflow_stage2_dict()
+        model.IF_1 = pyo.Var(model.T1, bounds=lambda model, t: (IF_1[t], IF_1[t]), initialize=IF_1)
+        model.IF_2 = pyo.Var(model.T2, model.S, bounds=lambda model, t, s: (IF_2[t, s], IF_2[t, s]), initialize=IF_2)
+        model.V_01 = pyo.Var(bounds=(data.V_01, data.V_01), initialize=data.V_01)
 
     # ---------- Declaring decision variables ----------
     model.q1 = pyo.Var(model.T1, bounds=(0, Q_max))         # variable of discharged water from reservoir in T1
@@ -54,9 +62,9 @@ def task1_model():
 
     # ---------- Objective function ----------
     def objective(model):
-        o1 = sum(model.p1[t] * (model.MP + t) for t in model.T1)        # profits for T1
-        o2 = sum(sum(model.Prob * model.p2[t, s] * (model.MP + t) for t in model.T2) for s in model.S)  # profits for T2 for rach scenario * probability
-        o3 = model.Prob * sum(model.WV * model.v_res2[48, s] for s in model.S)  # profits from Water Value * remaining reservoir level at the end of day 2
+        o1 = sum(model.p1[t] * model.MP[t] for t in model.T1)        # profits for T1
+        o2 = sum(sum(model.Prob[s] * model.p2[t, s] * model.MP[t] for t in model.T2) for s in model.S)  # profits for T2 for rach scenario * probability
+        o3 = sum(model.Prob[s] * model.WV * model.v_res2[T2[-1], s] for s in model.S)  # profits from Water Value * remaining reservoir level at the end of day 2
         obj = o1 + o2 + o3  # summing all profit areas
         return obj
     model.OBJ = pyo.Objective(rule=objective(model), sense=pyo.maximize)  # setting the objective to maximize profits
@@ -71,22 +79,34 @@ def task1_model():
     model.constr_productionDependency2 = pyo.Constraint(model.T2, model.S, rule=math_production2)
 
     def math_v_res1(model, t):  # variable dependency for production in T1
-        if t == 1:  # setting the start value of water reservoir at the start of day 1
-            return model.v_res1[t] == model.V_01 + model.IF_1 - model.q1[t]  # water reservoir = initial volume + inflow - discharge
+        if t == T1[0]:  # setting the start value of water reservoir at the start of day 1
+            return model.v_res1[t] == model.V_01 + model.IF_1[t] - model.q1[t]  # water reservoir = initial volume + inflow - discharge
         else:  # for the rest of time in T1
-            return model.v_res1[t] == model.v_res1[t-1] + model.IF_1 - model.q1[t]  # water reservoir = previous water level + inflow - discharge
+            return model.v_res1[t] == model.v_res1[t-1] + model.IF_1[t] - model.q1[t]  # water reservoir = previous water level + inflow - discharge
     model.constr_math_v_res1 = pyo.Constraint(model.T1, rule=math_v_res1)
 
     def math_v_res2(model, t, s):  # variable dependency for production in T2
-        if t == 25:  # setting the start value of water reservoir at the start of day 2
-            return model.v_res2[t, s] == model.v_res1[24] + (model.IF_2 * s) - model.q2[t, s]  # water reservoir = volume from t=24 + inflow - discharge
+        if t == T2[0]:  # setting the start value of water reservoir at the start of day 2
+            return model.v_res2[t, s] == model.v_res1[T1[-1]] + model.IF_2[t, s] - model.q2[t, s]  # water reservoir = volume from t=24 + inflow - discharge
         else:  # for the rest of time in T1
-            return model.v_res2[t, s] == model.v_res2[(t-1), s] + (model.IF_2 * s) - model.q2[t, s]  # water reservoir = previous water level + inflow - discharge
+            return model.v_res2[t, s] == model.v_res2[(t-1), s] + model.IF_2[t, s] - model.q2[t, s]  # water reservoir = previous water level + inflow - discharge
     model.constr_math_v_res2 = pyo.Constraint(model.T2, model.S, rule=math_v_res2)
 
-    # ---------- Initializing solver and solving the problem ----------
+    return model
+
 
-    SolverFactory('gurobi').solve(model)  # asking gurobi to solve
+def task1_model(data=None, solver=None):
+    """
+    Builds and solves the complete optimization model of the hydropower scheduling problem.
+    solver is the name of the solver to use, by default the first available one of solvers.SOLVER_ORDER
+    Returns the Solution (see solution.py), with the dispatch of every hour and scenario and the reservoir duals
+    """
+    model = build_task1_model(data)
+    model.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)  # to import the duals of the reservoir balances
+
+    # ---------- Initializing solver and solving the problem ----------
+    make_solver(solver).solve(model)  # asking the solver (gurobi if a license is free) to solve
     OBJ_value = round(model.OBJ(), 2)  # rounding to two decimal points
     print(f'\nThe total objective value is: {OBJ_value}')
 
+    return model_solution(model)
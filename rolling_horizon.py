@@ -0,0 +1,118 @@
+import time
+
+import numpy as np
+from pyomo.opt import TerminationCondition
+
+import solvers
+from model1 import build_task1_model
+from solution import stage1_solution
+from system_data import default_system_data
+
+
+class RollingHorizon:
+    """
+    Re-plans the task 1 problem each time a new forecast arrives, aka a rolling horizon.
+    The model is built once with build_task1_model(mutable=True) and kept in a persistent solver, so an update only
+    changes the prices (objective), and the bounds of the inflows and start level, and the solver warm-starts from
+    the previous solution instead of building and solving the model again.
+
+    Each update moves the window step hours forward. The first step hours of the previous dispatch are taken as
+    realized: the new window starts from the measured reservoir level if it is given, else from the planned level
+    after those hours, so step is 1 to the hours of stage 1. The window length (hours and scenarios) is that of data.
+    With step=None the window does not move: each update is a new instance of the same size, starting from v_res
+    (or V_01 of data), e.g. for BatchSolver
+    """
+
+    def __init__(self, data=None, step=1, solver=None):
+        if data is None:
+            data = default_system_data()
+        if step is not None and not 1 <= step <= data.hours_stage1:
+            raise ValueError(f'step must be between 1 and the {data.hours_stage1} hours of stage 1 (or None), not {step}')
+        self.data = data
+        self.step = step
+        self.hour = 1 if step is None else 1 - step  # the first update starts the window in hour 1
+        self.dispatch = None        # the last dispatch, to get the realized level from
+
+        self.model = build_task1_model(data, mutable=True)
+        self.opt = solvers.make_solver(solver, persistent=True)
+        solvers.set_instance(self.opt, self.model)
+        self.dispatch_vars = [var[t] for var in (self.model.q1, self.model.p1, self.model.v_res1) for t in data.T1]
+
+    def update(self, price, inflow, probabilities=None, v_res=None):
+        """
+        Re-plans for a new forecast of the window: price (T,), inflow (S, T), where stage 1 uses scenario 0 like in
+        SystemData, probabilities (S,) if they changed, and the measured reservoir level v_res if known.
+        Returns a dict with the dispatch of stage 1 as a Solution (see solution.py, q, p and v_res of the hours of
+        stage 1, and the objective), the first hour of the window and the time the update took
+        """
+        start = time.perf_counter()
+        model, T1, T2 = self.model, self.data.T1, self.data.T2
+        price = np.asarray(price, dtype=float)
+        inflow = np.atleast_2d(np.asarray(inflow, dtype=float))
+
+        # ---------- Moving the window ----------
+        if self.step is None:  # a new instance, from its own start level
+            v_res = self.data.V_01 if v_res is None else v_res
+        else:
+            self.hour += self.step
+            if v_res is None:  # no measurement, the realized level is the planned one after the executed hours
+                v_res = self.data.V_01 if self.dispatch is None else self.dispatch['solution'].v_res[0, self.step - 1]
+        self._set_value(model.V_01, v_res)
+
+        # ---------- Updating the forecasts ----------
+        for t in T1:
+            self._set_value(model.IF_1[t], inflow[0, t - 1])
+        for t in T2:
+            for s in model.S:
+                self._set_value(model.IF_2[t, s], inflow[s, t - 1])
+
+        model.MP.store_values(dict(zip(T1 + T2, price.tolist())))
+        if probabilities is not None:
+            model.Prob.store_values(dict(zip(model.S, np.asarray(probabilities, dtype=float).tolist())))
+        solvers.update_objective(self.opt, model.OBJ)  # the prices and probabilities are in the objective
+
+        # ---------- Re-solving from the previous solution ----------
+        results = solvers.solve_and_load(self.opt, model, self.dispatch_vars)  # reading back the dispatch of stage 1
+
+        status = results.solver.termination_condition
+        if status != TerminationCondition.optimal:  # e.g. more inflow than the reservoir and the turbine can take
+            raise RuntimeError(f'No optimal dispatch for the window starting in hour {self.hour}: {status}')
+
+        self.dispatch = {'hour': self.hour,
+                         'solution': stage1_solution(model, results.problem.lower_bound),  # maximizing, the objective of the solution
+                         'time': time.perf_counter() - start}
+        return self.dispatch
+
+    def _set_value(self, var, value):
+        """
+        Sets both bounds of an input variable (inflow or start level) to the new value, and tells the solver
+        """
+        value = float(value)
+        if var.lb != value:  # only the changed values are sent to the solver
+            var.setlb(value)
+            var.setub(value)
+            solvers.update_var(self.opt, var)
+
+
+def rolling_horizon(updates, data=None, step=1, solver=None):
+    """
+    Generator re-planning for every forecast update in updates (an iterable, e.g. a generator reading the forecasts
+    as they arrive), yielding the dispatch of each window. Each update is a dict with 'price' and 'inflow', and
+    optionally 'probabilities' and 'v_res', see RollingHorizon.update
+    """
+    scheduler = RollingHorizon(data, step, solver)
+    for update in updates:
+        yield scheduler.update(**update)
+
+
+async def rolling_horizon_async(queue, data=None, step=1, solver=None):
+    """
+    The same as rolling_horizon, reading the updates from an asyncio.Queue until it gets None.
+    The solves are short, so they are run in the event loop
+    """
+    scheduler = RollingHorizon(data, step, solver)
+    while True:
+        update = await queue.get()
+        if update is None:
+            break
+        yield scheduler.update(**update)
@@ -0,0 +1,119 @@
+import concurrent.futures
+import os
+
+import numpy as np
+import pyomo.environ as pyo
+
+import solvers
+
+
+# Every worker process keeps the single-scenario models and solvers of its own block of scenarios, filled by _init_worker
+_worker_setup = {}      # the solve-function given to the pool
+_worker_models = {}     # scenario -> (modelSub, opt), built once for each scenario of the block
+
+
+def _init_worker(build_function, solve_function, solver_name, data, block):
+    """
+    Initializer for each worker process in the pool, building the single-scenario subproblem and persistent solver
+    of every scenario in its block
+    """
+    _worker_setup['solve'] = solve_function
+    for scenario in block:
+        modelSub = build_function(1, scenario=scenario, data=data)  # num_scenario = 1 gives the unweighted one-scenario model
+        opt = solvers.make_solver(solver_name, persistent=True)
+        solvers.set_instance(opt, modelSub)
+        _worker_models[scenario] = (modelSub, opt)
+
+
+def _solve_block(task):
+    """
+    Function run in the worker process, solving the subproblems of the given scenarios of its block for every state
+    value. Returns one list of (scenario, probability, OBJ, Dual) pr. state
+    """
+    scenarios, states = task
+
+    results = []
+    for state in states:
+        state_results = []
+        for scenario in scenarios:
+            modelSub, opt = _worker_models[scenario]
+            OBJ, Dual = _worker_setup['solve'](modelSub, opt, state)
+            state_results.append((scenario, pyo.value(modelSub.Prob[scenario]), OBJ, Dual))
+        results.append(state_results)
+
+    return results
+
+
+class ScenarioPool:
+    """
+    The worker processes of the scenario-decomposed subproblem. The scenarios are split in one fixed block pr.
+    worker, and each worker is its own one-process executor, so a scenario is always solved by the same worker and
+    its model is built only once (S models in all, instead of one pr. scenario in every worker).
+    Each call sends one task pr. block, and the worker loops over its scenarios
+    """
+
+    def __init__(self, build_function, solve_function, max_workers=None, solver_name=None, data=None):
+        num_workers = min(max_workers or os.cpu_count() or 1, len(data.S))
+        self.blocks = [list(block) for block in np.array_split(data.S, num_workers)]
+        self.block_of = {s: i for i, block in enumerate(self.blocks) for s in block}  # scenario -> its block
+        self.executors = [concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=_init_worker,
+                                                                 initargs=(build_function, solve_function,
+                                                                           solver_name, data, [int(s) for s in block]))
+                          for block in self.blocks]
+
+    def solve(self, scenarios, states):
+        """
+        Solves the scenarios for every state value, all the blocks at the same time.
+        Returns one list of (scenario, probability, OBJ, Dual) pr. state, in the order of the scenarios
+        """
+        tasks = {}
+        for s in scenarios:
+            tasks.setdefault(self.block_of[s], []).append(s)
+        futures = [self.executors[i].submit(_solve_block, (block_scenarios, states))
+                   for i, block_scenarios in tasks.items()]
+
+        by_scenario = [{} for _ in states]
+        for future in futures:
+            for state_results, block_results in zip(by_scenario, future.result()):
+                state_results.update((result[0], result) for result in block_results)
+        return [[state_results[s] for s in scenarios] for state_results in by_scenario]
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+
+def create_pool(build_function, solve_function, max_workers=None, solver_name=None, data=None):
+    """
+    Creates the ScenarioPool for the scenario-decomposed subproblem.
+    build_function and solve_function are the build_subProblem and solve_subProblem of Benders.py or StochasticDP.py,
+    solver_name is the solver each worker uses (see solvers.select_solver), data is the SystemData sent to each worker
+    """
+    return ScenarioPool(build_function, solve_function, max_workers, solver_name, data)
+
+
+def solve_scenarios(pool, scenarios, state):
+    """
+    Solves every scenario as its own small LP on the pool, for the same state value.
+    Returns a list of (scenario, probability, OBJ, Dual), in the same order as the scenarios
+    """
+    return pool.solve(scenarios, [state])[0]
+
+
+def solve_scenarios_for_states(pool, scenarios, states):
+    """
+    Solves every scenario for every state value in one go on the pool, one task pr. block of scenarios.
+    Returns one list of (scenario, probability, OBJ, Dual) pr. state, in the same order as the states
+    """
+    return pool.solve(scenarios, list(states))
+
+
+def combine_cut(scenario_results):
+    """
+    Combines the scenario results into the probability-weighted OBJ and Dual of the monolithic subproblem,
+    to generate one cut the same way as from subProblem
+    """
+    OBJ = sum(prob * obj for s, prob, obj, dual in scenario_results)
+    Dual = sum(prob * dual for s, prob, obj, dual in scenario_results)
+
+    return OBJ, Dual
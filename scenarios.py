@@ -0,0 +1,152 @@
+import numpy as np
+
+from system_data import SystemData
+
+
+def sample_scenarios(history_inflow, history_price=None, num_samples=1000, noise=0.1, rho=0.9, seed=0):
+    """
+    Samples num_samples stage 2 trajectories from the historical series, aka a bootstrap with noise:
+    each sample is a random historical trajectory (a row of history_inflow, (N, H) over the hours of stage 2),
+    multiplied by exp(noise * e_t), where e_t is a standard normal AR(1) series with the hour-to-hour correlation rho.
+    With history_price (N, H) as well, the price of the same historical row is sampled with its own noise.
+    All the samples are made at once with NumPy, returns the inflow samples (num_samples, H) and the price samples
+    (or None)
+    """
+    rng = np.random.default_rng(seed)
+    history_inflow = np.atleast_2d(np.asarray(history_inflow, dtype=float))
+    rows = rng.integers(history_inflow.shape[0], size=num_samples)  # the historical trajectory of each sample
+
+    def ar1_noise(shape):  # e_t = rho * e_t-1 + sqrt(1 - rho^2) * z_t, so every e_t is standard normal
+        z = rng.standard_normal(shape)
+        e = np.empty(shape)
+        e[:, 0] = z[:, 0]
+        for t in range(1, shape[1]):  # over the hours, all the samples at once
+            e[:, t] = rho * e[:, t - 1] + np.sqrt(1 - rho ** 2) * z[:, t]
+        return e
+
+    inflow = history_inflow[rows] * np.exp(noise * ar1_noise((num_samples, history_inflow.shape[1])))
+    price = None
+    if history_price is not None:
+        history_price = np.atleast_2d(np.asarray(history_price, dtype=float))
+        price = history_price[rows] * np.exp(noise * ar1_noise((num_samples, history_price.shape[1])))
+    return inflow, price
+
+
+def _features(inflow, price=None):
+    """
+    The vectors the scenarios are compared by, each series scaled by its standard deviation so they weigh the same
+    """
+    features = [inflow / max(inflow.std(), 1e-12)]
+    if price is not None:
+        features.append(price / max(price.std(), 1e-12))
+    return np.hstack(features)
+
+
+def _distances(x, y):
+    """
+    The Euclidean distance between every row of x and every row of y, with one matrix product
+    """
+    squared = (x ** 2).sum(axis=1)[:, None] + (y ** 2).sum(axis=1)[None, :] - 2 * x @ y.T
+    return np.sqrt(np.maximum(squared, 0))
+
+
+def fast_forward_selection(features, probabilities, num_scenarios):
+    """
+    Fast forward selection (Heitsch and Roemisch): picks the num_scenarios samples that one by one reduce the
+    probability-weighted distance from every sample to its closest picked sample the most.
+    The probability of each sample not picked is moved to its closest picked sample.
+    Needs the (N, N) distance matrix, so for many more samples kmeans_reduction uses less memory.
+    Returns the indices of the picked samples and their probabilities
+    """
+    distance = _distances(features, features)
+    selected = []
+    remaining = np.ones(len(features), dtype=bool)
+
+    for _ in range(num_scenarios):
+        # the weighted distance of all the other samples, if the candidate (column) is picked as well
+        cost = probabilities[remaining] @ distance[remaining]
+        cost[~remaining] = np.inf
+        u = int(cost.argmin())
+        selected.append(u)
+        remaining[u] = False
+        distance = np.minimum(distance, distance[:, [u]])  # the distance to the closest picked sample so far
+
+    selected = np.array(selected)
+    closest = _distances(features, features[selected]).argmin(axis=1)
+    new_probabilities = np.bincount(closest, weights=probabilities, minlength=len(selected))
+    return selected, new_probabilities
+
+
+def kmeans_reduction(features, probabilities, num_scenarios, iterations=100, seed=0):
+    """
+    Probability-weighted k-means: the samples are grouped in num_scenarios clusters, and the sample closest to the
+    centre of each cluster represents it, with the probability of the whole cluster.
+    Only needs the (N, num_scenarios) distances, so it works for many samples.
+    Returns the indices of the representing samples and their probabilities
+    """
+    rng = np.random.default_rng(seed)
+
+    # k-means++ start: each new centre is drawn with probability proportional to the squared distance to the others
+    centres = [features[rng.choice(len(features), p=probabilities)]]
+    for _ in range(1, num_scenarios):
+        squared = _distances(features, np.array(centres)).min(axis=1) ** 2 * probabilities
+        centres.append(features[rng.choice(len(features), p=squared / squared.sum())])
+    centres = np.array(centres)
+
+    for _ in range(iterations):
+        cluster = _distances(features, centres).argmin(axis=1)
+        weights = np.bincount(cluster, weights=probabilities, minlength=num_scenarios)
+        new_centres = np.zeros_like(centres)
+        np.add.at(new_centres, cluster, features * probabilities[:, None])  # weighted sum of each cluster
+        empty = weights == 0
+        new_centres[~empty] /= weights[~empty, None]
+        new_centres[empty] = centres[empty]  # an empty cluster keeps its centre
+        if np.allclose(new_centres, centres):
+            break
+        centres = new_centres
+
+    cluster = _distances(features, centres).argmin(axis=1)
+    selected = _distances(centres, features).argmin(axis=1)  # the real sample closest to each centre
+    new_probabilities = np.bincount(cluster, weights=probabilities, minlength=num_scenarios)
+    keep = new_probabilities > 0
+    return selected[keep], new_probabilities[keep]
+
+
+def reduce_scenarios(inflow, num_scenarios, probabilities=None, price=None, method='fast_forward', seed=0):
+    """
+    Reduces the sampled trajectories (inflow (N, H), and price (N, H) if given) to num_scenarios representative
+    scenarios, with method 'fast_forward' (fast_forward_selection) or 'kmeans' (kmeans_reduction).
+    Returns the indices of the kept samples and their probabilities, which sum to 1
+    """
+    probabilities = np.full(len(inflow), 1 / len(inflow)) if probabilities is None else np.asarray(probabilities)
+    features = _features(inflow, price)
+    if method == 'fast_forward':
+        return fast_forward_selection(features, probabilities, num_scenarios)
+    if method == 'kmeans':
+        return kmeans_reduction(features, probabilities, num_scenarios, seed=seed)
+    raise ValueError(f'Unknown scenario reduction method: {method}')
+
+
+def scenario_system_data(price, inflow_stage1, history_inflow, num_scenarios=5, num_samples=1000,
+                         method='fast_forward', history_price=None, noise=0.1, rho=0.9, seed=0, **kwargs):
+    """
+    The whole scenario pipeline: samples num_samples stage 2 trajectories from the history, reduces them to
+    num_scenarios scenarios, and returns the SystemData to give task1_model, subProblem, Benders_loop, ... as data.
+    num_scenarios is the one knob trading the solve time against the accuracy.
+
+    price is the price curve over the whole horizon, inflow_stage1 the (deterministic) inflow of stage 1, and the
+    history rows are over the hours of stage 2. With history_price the price is sampled and reduced together with
+    the inflow, and as the models have one price curve, stage 2 gets the expected price of the kept scenarios.
+    The other SystemData values (V_max, ...) are given as keyword arguments
+    """
+    inflow_stage1 = np.asarray(inflow_stage1, dtype=float)
+    price = np.asarray(price, dtype=float).copy()
+    inflow_samples, price_samples = sample_scenarios(history_inflow, history_price, num_samples, noise, rho, seed)
+    selected, probabilities = reduce_scenarios(inflow_samples, num_scenarios, price=price_samples, method=method,
+                                               seed=seed)
+
+    if price_samples is not None:
+        price[len(inflow_stage1):] = probabilities @ price_samples[selected]  # the expected price in stage 2
+
+    inflow = np.hstack([np.tile(inflow_stage1, (len(selected), 1)), inflow_samples[selected]])  # (S, T)
+    return SystemData(price, inflow, probabilities=probabilities, hours_stage1=len(inflow_stage1), **kwargs)
@@ -0,0 +1,249 @@
+import concurrent.futures
+import math
+
+import numpy as np
+import pyomo.environ as pyo
+
+import solvers
+from solution import Solution
+from system_data import default_system_data
+
+
+def build_stageProblem(data, stage, scenario, hours_per_stage):
+    """
+    The problem of one stage (hours_per_stage hours) and one inflow scenario in the multi-stage SDDP.
+    Like the subproblem, the incoming reservoir level is a mutable parameter with the constr_dualvalue constraint,
+    and like the master problem, alpha represents the value of the later stages through the cuts in listOfCuts.
+    The last stage has no alpha, but the water value of the reservoir level at the end of the horizon
+    """
+    n_stages = len(data.price) // hours_per_stage
+    last_stage = stage == n_stages
+
+    # ---------- Set data ----------
+    T = list(range((stage - 1) * hours_per_stage + 1, stage * hours_per_stage + 1))  # the hours of this stage
+
+    # ---------- Parameters data ----------
+    alpha_max = float(data.P_max * data.price[T[-1]:].sum() + data.WV_end * data.V_max)  # bound on the future profits
+
+    model = pyo.ConcreteModel()
+
+    # ---------- Declaring sets ----------
+    model.T = pyo.Set(initialize=T)
+
+    # ---------- Declaring parameters ----------
+    model.MP = pyo.Param(model.T, initialize=data.price_dict(T))                                    # Market price at t
+    model.IF = pyo.Param(model.T, initialize={t: float(data.inflow[scenario, t - 1]) for t in T})   # Inflow of the scenario
+    model.WV = pyo.Param(initialize=data.WV_end)                                                    # Water value at the end
+    model.E_conv = pyo.Param(initialize=data.E_conv)                    # Conversion of power, p, produced pr. discarged water, q
+    model.v_in = pyo.Param(initialize=data.V_01, mutable=True)          # reservoir level at the start of the stage
+
+    # ---------- Declaring decision variables ----------
+    model.q = pyo.Var(model.T, bounds=(0, data.Q_max))      # variable of discharged water from reservoir
+    model.p = pyo.Var(model.T, bounds=(0, data.P_max))      # variable for production of power
+    model.v_res = pyo.Var(model.T, bounds=(0, data.V_max))  # variable for reservoir level
+    model.v_in_var = pyo.Var(bounds=(0, data.V_max))        # the incoming state, to get the dual value
+    model.alpha = pyo.Var(bounds=(-alpha_max, alpha_max) if not last_stage else (0, 0))  # value of the later stages
+
+    # ---------- Objective function ----------
+    def objective(model):
+        obj = sum(model.p[t] * model.MP[t] for t in model.T) + model.alpha  # profits of the stage + the later stages
+        if last_stage:
+            obj += model.WV * model.v_res[T[-1]]  # profits from Water Value * remaining reservoir level at the end
+        return obj
+    model.OBJ = pyo.Objective(rule=objective(model), sense=pyo.maximize)
+
+    # ---------- Declaring constraints ----------
+    def math_production(model, t):  # production = water discharge * power equivalent
+        return model.p[t] == model.q[t] * model.E_conv
+    model.constr_productionDependency = pyo.Constraint(model.T, rule=math_production)
+
+    def math_v_res(model, t):  # water reservoir = previous water level + inflow - discharge
+        if t == T[0]:
+            return model.v_res[t] == model.v_in_var + model.IF[t] - model.q[t]
+        return model.v_res[t] == model.v_res[t - 1] + model.IF[t] - model.q[t]
+    model.constr_math_v_res = pyo.Constraint(model.T, rule=math_v_res)
+
+    def v_res_start(model):  # the incoming reservoir level, so we can get the dual value
+        return model.v_in_var == model.v_in
+    model.constr_dualvalue = pyo.Constraint(rule=v_res_start)
+
+    model.listOfCuts = pyo.ConstraintList()  # cuts from the backward pass of the next stage
+    model.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)
+
+    return model
+
+
+def add_cut_stageProblem(model, cut, opt=None):
+    """
+    Function to add one cut (in the generate_cuts format) of the next stage to the stage problem
+    """
+    new_cut = model.listOfCuts.add(model.alpha <= cut['a'] * model.v_res[model.T.last()] + cut['b'])
+    if opt is not None:
+        solvers.add_constraint(opt, new_cut)
+
+
+def solve_stageProblem(model, opt, v_in):
+    """
+    Function to solve the stage problem for the incoming reservoir level v_in.
+    Returns OBJ, Dual (of the incoming level), the outgoing reservoir level and the profit of this stage alone
+    """
+    model.v_in = v_in
+
+    solvers.update_constraint(opt, model.constr_dualvalue)  # a persistent solver does not see parameter changes
+
+    opt.solve(model, load_solutions=True)
+    solvers.load_duals(opt, [model.constr_dualvalue])
+
+    OBJ = model.OBJ()
+    immediate_profit = OBJ - model.alpha.value  # the profit of the stage, without the value of the later stages
+    return OBJ, model.dual.get(model.constr_dualvalue), model.v_res[model.T.last()].value, immediate_profit
+
+
+def build_stages(data, hours_per_stage, solver_name=None):
+    """
+    Builds the problems of all the stages and scenarios, each with its own solver.
+    Stage 1 is deterministic, so it only has scenario 0. Returns {(stage, scenario): (model, opt)}
+    """
+    n_stages = len(data.price) // hours_per_stage
+    models = {}
+    for stage in range(1, n_stages + 1):
+        for s in ([0] if stage == 1 else data.S):
+            model = build_stageProblem(data, stage, s, hours_per_stage)
+            opt = solvers.make_solver(solver_name, persistent=True)
+            solvers.set_instance(opt, model)
+            models[stage, s] = (model, opt)
+    return models
+
+
+def sync_cuts(models, cuts_by_stage, added):
+    """
+    Adds the cuts in cuts_by_stage ({stage: {key: cut}}) that are not yet in the models, added keeps track of the keys
+    """
+    for (stage, s), (model, opt) in models.items():
+        for key, cut in cuts_by_stage.get(stage, {}).items():
+            if (stage, s, key) not in added:
+                add_cut_stageProblem(model, cut, opt)
+                added.add((stage, s, key))
+
+
+def forward_pass(models, data, path):
+    """
+    Simulates the policy given by the cuts along one inflow path (a scenario for each stage, stage 1 is scenario 0).
+    Returns the outgoing reservoir level of each stage and the total profit of the path
+    """
+    v_in = data.V_01
+    states, profit = [], 0
+    for stage, s in enumerate(path, start=1):
+        model, opt = models[stage, s]
+        OBJ, Dual, v_in, immediate_profit = solve_stageProblem(model, opt, v_in)
+        states.append(v_in)
+        profit += immediate_profit
+    return states, profit
+
+
+# Every worker process of the parallel forward pass keeps its own stage problems and solvers
+_worker = {}
+
+
+def _init_forward_worker(data, hours_per_stage, solver_name):
+    _worker['data'] = data
+    _worker['models'] = build_stages(data, hours_per_stage, solver_name)
+    _worker['added'] = set()
+
+
+def _forward_worker(task):
+    """
+    Function run in the worker process, updating the worker's cuts and simulating one path
+    """
+    path, cuts_by_stage = task
+    sync_cuts(_worker['models'], cuts_by_stage, _worker['added'])
+    return forward_pass(_worker['models'], _worker['data'], path)
+
+
+def SDDP_loop(data=None, hours_per_stage=24, num_forward=10, max_iterations=50, z=1.96, rel_gap=1e-4,
+              min_iterations=3, max_workers=None, seed=0, solver=None):
+    """
+    The run-function for multi-stage Stochastic Dual Dynamic Programming, the master/sub/cut pattern of Benders_loop
+    for any number of stages. The horizon of data is split in stages of hours_per_stage hours, and the inflow
+    scenarios of each stage are independent of the other stages.
+
+    Each iteration does:
+    - a forward pass, simulating num_forward sampled inflow paths on a process pool of max_workers processes
+      (max_workers=1 runs the paths in this process)
+    - a backward pass, solving all scenarios of each stage in the reservoir levels of the forward pass, and adding
+      the probability-weighted cut to the stage before
+    The upper bound is the objective of stage 1. After min_iterations, the loop stops when the upper bound is inside
+    the z-confidence interval of the sampled policy value (or within rel_gap of the mean) and has changed less than
+    rel_gap since the last iteration, or after max_iterations.
+    solver is the name of the solver to use, by default gurobi if a license is free, else an open-source solver
+    Returns the Solution of stage 1 with all the cuts (see solution.py), the bounds of each iteration and the cuts
+    of each stage
+    """
+    if data is None:
+        data = default_system_data()
+    solver_name = solvers.select_solver(solver)  # the same solver in this process and in the worker processes
+
+    n_stages = len(data.price) // hours_per_stage
+    if n_stages * hours_per_stage != len(data.price):
+        raise ValueError(f'The horizon of {len(data.price)} hours is not a whole number of {hours_per_stage} hour stages')
+
+    rng = np.random.default_rng(seed)
+    models = build_stages(data, hours_per_stage, solver_name)  # the models of the backward pass
+    added = set()
+    cuts_by_stage = {stage: {} for stage in range(1, n_stages)}  # the cuts bounding the alpha of each stage
+    bounds = []
+    previous_upper = float('inf')
+
+    pool = None
+    if max_workers != 1:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_forward_worker,
+                                                      initargs=(data, hours_per_stage, solver_name))
+
+    for iteration in range(1, max_iterations + 1):
+        # ---------- Forward pass ----------
+        paths = [[0] + [int(s) for s in rng.choice(data.S, size=n_stages - 1, p=data.probabilities)] for _ in range(num_forward)]
+        if pool is not None:
+            results = list(pool.map(_forward_worker, [(path, cuts_by_stage) for path in paths]))
+        else:
+            results = [forward_pass(models, data, path) for path in paths]
+        profits = np.array([profit for states, profit in results])
+
+        # ---------- Backward pass ----------
+        for stage in range(n_stages, 1, -1):
+            for n, (states, profit) in enumerate(results):
+                v_out = states[stage - 2]  # the reservoir level leaving the stage before
+                OBJ, Dual = 0, 0
+                for s in data.S:  # the probability-weighted cut over the scenarios of this stage
+                    model, opt = models[stage, s]
+                    OBJ_s, Dual_s, v_next, immediate_profit = solve_stageProblem(model, opt, v_out)
+                    OBJ += data.probabilities[s] * OBJ_s
+                    Dual += data.probabilities[s] * Dual_s
+                cuts_by_stage[stage - 1][(iteration, n)] = {'a': Dual, 'b': OBJ - Dual * v_out}
+            sync_cuts({key: value for key, value in models.items() if key[0] == stage - 1}, cuts_by_stage, added)
+
+        # ---------- Bounds and stopping rule ----------
+        model, opt = models[1, 0]
+        upper_bound = solve_stageProblem(model, opt, data.V_01)[0]
+        mean = profits.mean()
+        half_width = z * profits.std(ddof=1) / math.sqrt(num_forward) if num_forward > 1 else 0
+        bounds.append({'iteration': iteration, 'upper': upper_bound, 'lower_mean': mean, 'lower_half_width': half_width})
+        print(f'Iteration {iteration}: upper bound {round(upper_bound, 2)}, '
+              f'policy value {round(mean, 2)} +- {round(half_width, 2)}')
+
+        statistically_converged = upper_bound - mean <= max(half_width, rel_gap * abs(upper_bound))
+        upper_bound_stable = previous_upper - upper_bound <= rel_gap * abs(upper_bound)
+        previous_upper = upper_bound
+        if iteration >= min_iterations and statistically_converged and upper_bound_stable:
+            print(f'Converged after {iteration} iterations')
+            break
+
+    if pool is not None:
+        pool.shutdown()
+
+    # the dispatch of stage 1 from its last solve (the upper bound), with the cuts of the last backward pass
+    model = models[1, 0][0]
+    T = list(model.T)
+    v_res = [model.v_res[t].value for t in T]
+    solution = Solution(model.OBJ(), T, [0], [1.0], [model.q[t].value for t in T], [model.p[t].value for t in T],
+                        v_res, alpha=model.alpha.value, state=v_res[-1])
+    return solution, bounds, cuts_by_stage
@@ -0,0 +1,191 @@
+import json
+import os
+
+import numpy as np
+import pyomo.environ as pyo
+
+
+class Solution:
+    """
+    The solution of one solve as NumPy arrays, returned by task1_model, masterProblem, subProblem, ... so the
+    dispatch can be read (and saved) after the solve, without solving again:
+    - objective:      the objective value
+    - hours:          (T,) the hours of the model
+    - scenarios:      (S,) the scenarios of the model, [0] for the master problem that has no scenarios
+    - probabilities:  (S,) probability of each scenario
+    - q, p, v_res:    (S, T) discharge, production and reservoir level pr. scenario and hour.
+                      Stage 1 has one dispatch for all scenarios, so its hours are the same in every row
+    - balance_dual:   (S, T) duals of the reservoir balances (constr_math_v_res1/2), as the solver gives them, so the
+                      stage 2 duals of a probability-weighted model are weighted. NaN where they were not loaded
+    - alpha:          the value of alpha in a master problem, else None
+    - state:          the reservoir level in the last hour of stage 1, the state between the stages
+    - state_dual:     the dual of constr_dualvalue in a subproblem (the slope of the cut), else None
+    - reservoirs:     (R,) the reservoirs of a cascade, else None. With reservoirs the arrays are (S, T, R),
+                      and state is an array (R,)
+    """
+
+    def __init__(self, objective, hours, scenarios, probabilities, q, p, v_res, balance_dual=None,
+                 alpha=None, state=None, state_dual=None, reservoirs=None):
+        self.objective = float(objective)
+        self.hours = np.asarray(hours, dtype=np.int64)
+        self.scenarios = np.asarray(scenarios, dtype=np.int64)
+        self.probabilities = np.asarray(probabilities, dtype=float)
+        self.reservoirs = None if reservoirs is None else np.asarray(reservoirs, dtype=np.int64)
+        shape = (len(self.scenarios), len(self.hours))
+        if self.reservoirs is not None:
+            shape += (len(self.reservoirs),)
+        self.q = np.ascontiguousarray(np.broadcast_to(q, shape), dtype=float)
+        self.p = np.ascontiguousarray(np.broadcast_to(p, shape), dtype=float)
+        self.v_res = np.ascontiguousarray(np.broadcast_to(v_res, shape), dtype=float)
+        self.balance_dual = np.ascontiguousarray(np.broadcast_to(np.nan if balance_dual is None else balance_dual,
+                                                                 shape), dtype=float)
+        self.alpha = alpha
+        self.state = state
+        self.state_dual = state_dual
+
+    def __repr__(self):
+        reservoirs = '' if self.reservoirs is None else f', reservoirs={len(self.reservoirs)}'
+        return (f'Solution(objective={round(self.objective, 2)}, hours={len(self.hours)}, '
+                f'scenarios={len(self.scenarios)}{reservoirs})')
+
+    def scalars(self):
+        state = self.state.tolist() if isinstance(self.state, np.ndarray) else self.state  # an array for a cascade
+        return {'objective': self.objective, 'alpha': self.alpha, 'state': state, 'state_dual': self.state_dual}
+
+    def save_npz(self, path):
+        """
+        Saves the arrays as they are to a NumPy .npz file, the values that are None are left out.
+        Loaded again by load_solution
+        """
+        scalars = {key: value for key, value in self.scalars().items() if value is not None}
+        if self.reservoirs is not None:
+            scalars['reservoirs'] = self.reservoirs
+        np.savez(path, hours=self.hours, scenarios=self.scenarios, probabilities=self.probabilities,
+                 q=self.q, p=self.p, v_res=self.v_res, balance_dual=self.balance_dual, **scalars)
+
+    def save_parquet(self, path):
+        """
+        Saves the solution as a Parquet file with one row pr. scenario and hour (and reservoir), and the columns
+        scenario, hour, (reservoir,) probability, q, p, v_res and balance_dual. The (S, T) arrays are C-ordered, so
+        each column is a flat view of an array, handed to Arrow without a copy. The single values are stored in the
+        file's metadata. Loaded again by load_solution
+        """
+        import pyarrow as pa  # only needed for Parquet files
+        import pyarrow.parquet as pq
+
+        num_scenarios, num_hours = self.q.shape[:2]
+        num_reservoirs = 1 if self.reservoirs is None else len(self.reservoirs)
+        columns = {'scenario': np.repeat(self.scenarios, num_hours * num_reservoirs),
+                   'hour': np.tile(np.repeat(self.hours, num_reservoirs), num_scenarios),
+                   'probability': np.repeat(self.probabilities, num_hours * num_reservoirs),
+                   'q': self.q.ravel(), 'p': self.p.ravel(), 'v_res': self.v_res.ravel(),
+                   'balance_dual': self.balance_dual.ravel()}
+        if self.reservoirs is not None:
+            columns['reservoir'] = np.tile(self.reservoirs, num_scenarios * num_hours)
+        table = pa.table({name: pa.array(column) for name, column in columns.items()},
+                         metadata={'solution': json.dumps(self.scalars())})
+        pq.write_table(table, path)
+
+
+def load_solution(path):
+    """
+    Loads a Solution saved with Solution.save_npz (.npz) or Solution.save_parquet (.parquet)
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.npz':
+        with np.load(path) as npz:
+            values = {key: npz[key] for key in npz.files}
+        for key in values:
+            if values[key].ndim == 0:
+                values[key] = values[key].item()  # the single values are stored as 0-d arrays
+        return Solution(**values)
+
+    if extension == '.parquet':
+        import pyarrow.parquet as pq  # only needed for Parquet files
+        table = pq.read_table(path)
+        columns = {name: column.to_numpy() for name, column in zip(table.column_names, table.columns)}
+        scenarios, first = np.unique(columns['scenario'], return_index=True)
+        reservoirs = np.unique(columns['reservoir']) if 'reservoir' in columns else None
+        step = 1 if reservoirs is None else len(reservoirs)
+        hours = columns['hour'][:len(columns['hour']) // len(scenarios):step]
+        shape = (len(scenarios), len(hours)) + (() if reservoirs is None else (len(reservoirs),))
+        scalars = json.loads(table.schema.metadata[b'solution'])
+        if isinstance(scalars['state'], list):
+            scalars['state'] = np.array(scalars['state'])
+        return Solution(hours=hours, scenarios=scenarios, probabilities=columns['probability'][first],
+                        q=columns['q'].reshape(shape), p=columns['p'].reshape(shape),
+                        v_res=columns['v_res'].reshape(shape), balance_dual=columns['balance_dual'].reshape(shape),
+                        reservoirs=reservoirs, **scalars)
+
+    raise ValueError(f'Unknown solution file type: {extension}')
+
+
+def _values(component, index):
+    """
+    The values of a variable over index, as an array
+    """
+    return np.fromiter((component[i].value for i in index), dtype=float, count=len(index))
+
+
+def _duals(model, constraint, index):
+    """
+    The duals of a constraint over index from the model's dual suffix, NaN where there is none
+    """
+    if not hasattr(model, 'dual'):
+        return np.full(len(index), np.nan)
+    return np.fromiter((model.dual.get(constraint[i], np.nan) for i in index), dtype=float, count=len(index))
+
+
+def stage1_solution(model, objective=None):
+    """
+    The Solution of only the stage 1 dispatch (q1, p1 and v_res1) of a solved task 1 or master problem, with one
+    row like a master problem. objective is the objective of the solve when not all the variables are loaded
+    (e.g. by solvers.solve_and_load), else it is read from the model
+    """
+    T1 = list(model.T1)
+    v_res = _values(model.v_res1, T1)
+    return Solution(model.OBJ() if objective is None else objective, T1, [0], [1.0],
+                    _values(model.q1, T1), _values(model.p1, T1), v_res, state=float(v_res[-1]))
+
+
+def model_solution(model):
+    """
+    Reads the Solution of a solved Pyomo model of the repo: the task 1 model, a master problem (q1, p1, v_res1
+    and alpha) or a subproblem (q2, p2, v_res2 and constr_dualvalue). The duals are read from the model's dual
+    suffix if it has one
+    """
+    hours, stages = [], []
+
+    if hasattr(model, 'q1'):  # stage 1, one row that is the same in every scenario
+        T1 = list(model.T1)
+        hours += T1
+        stages.append([_values(model.q1, T1), _values(model.p1, T1), _values(model.v_res1, T1),
+                       _duals(model, model.constr_math_v_res1, T1)])
+
+    if hasattr(model, 'q2'):  # stage 2, one row pr. scenario
+        T2, S = list(model.T2), list(model.S)
+        index = [(t, s) for s in S for t in T2]  # scenario-major, so the values fill the (S, T2) arrays row by row
+        hours += T2
+        stages.append([_values(model.q2, index).reshape(len(S), len(T2)),
+                       _values(model.p2, index).reshape(len(S), len(T2)),
+                       _values(model.v_res2, index).reshape(len(S), len(T2)),
+                       _duals(model, model.constr_math_v_res2, index).reshape(len(S), len(T2))])
+        scenarios = S
+        probabilities = [pyo.value(model.Prob[s]) for s in S]
+    else:
+        scenarios, probabilities = [0], [1.0]
+
+    rows = len(scenarios)
+    q, p, v_res, balance_dual = (np.hstack([np.broadcast_to(stage[k], (rows, stage[k].shape[-1])) for stage in stages])
+                                 for k in range(4))
+
+    alpha = model.alpha.value if hasattr(model, 'alpha') else None
+    state = state_dual = None
+    if hasattr(model, 'v_res1'):
+        state = model.v_res1[model.T1.last()].value
+    if hasattr(model, 'constr_dualvalue'):  # a subproblem, the state is the right-hand side of constr_dualvalue
+        state = pyo.value(model.constr_dualvalue.upper)
+        state_dual = model.dual.get(model.constr_dualvalue) if hasattr(model, 'dual') else None
+
+    return Solution(model.OBJ(), hours, scenarios, probabilities, q, p, v_res, balance_dual, alpha, state, state_dual)
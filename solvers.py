@@ -0,0 +1,155 @@
+import functools
+import time
+
+import pyomo.environ as pyo
+from pyomo.opt import SolverFactory, TerminationCondition
+
+
+# The solvers tried in this order when no solver is chosen, the open-source ones when no Gurobi license is free
+SOLVER_ORDER = ['gurobi', 'appsi_highs', 'cbc', 'glpk']
+
+# The persistent interface of a solver, keeping the model (and basis) in the solver between the solves
+PERSISTENT_NAMES = {'gurobi': 'gurobi_persistent', 'appsi_highs': 'appsi_highs'}
+
+
+def solver_available(name):
+    """
+    Checks if the solver can be used here, for Gurobi that gurobipy is installed and a license (seat) is free
+    """
+    try:
+        return bool(SolverFactory(PERSISTENT_NAMES.get(name, name)).available(exception_flag=False))
+    except Exception:  # an unknown or broken solver plugin, or no Gurobi license
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def gurobi_license_limited():
+    """
+    Checks once pr. process if the Gurobi license is size-limited (like the license that comes with pip install
+    gurobipy, at most 2000 variables and constraints), by solving an empty model with 2001 variables.
+    Pyomo's license_is_valid() is always True, and the limit is only seen when a model over it is solved
+    """
+    import gurobipy as gp  # only here when gurobi is available
+    try:
+        with gp.Env(params={'OutputFlag': 0}) as env, gp.Model(env=env) as model:
+            model.addVars(2001)
+            model.optimize()
+    except gp.GurobiError as error:
+        return error.errno == gp.GRB.Error.SIZE_LIMIT_EXCEEDED
+    return False
+
+
+def select_solver(name=None):
+    """
+    Returns the name of the solver to use: name if given, else the first available solver in SOLVER_ORDER.
+    Gurobi with a size-limited license is skipped, as most of the problems (e.g. benchmark_data(96, 50) or a cascade)
+    are over the limit and would fail in the middle of a run. Give solver='gurobi' to use it anyway.
+    The name (and not the solver) is passed on, so worker processes can make their own solver from it
+    """
+    if name is not None:
+        return name
+    for candidate in SOLVER_ORDER:
+        if solver_available(candidate) and not (candidate == 'gurobi' and gurobi_license_limited()):
+            return candidate
+    raise RuntimeError(f'None of the solvers {SOLVER_ORDER} are available')
+
+
+def make_solver(name=None, persistent=False):
+    """
+    Makes the solver (the first available one if name is None), with its persistent interface if persistent=True
+    and the solver has one
+    """
+    name = select_solver(name)
+    return SolverFactory(PERSISTENT_NAMES.get(name, name) if persistent else name)
+
+
+# ---------- Keeping persistent solvers up to date ----------
+# gurobi_persistent must be told about every change, the appsi solvers find the changes themselves on the next solve,
+# and the other solvers write the whole model on every solve
+
+def set_instance(opt, model):
+    if hasattr(opt, 'set_instance'):
+        opt.set_instance(model)
+
+
+def add_constraint(opt, constraint):
+    if hasattr(opt, 'add_constraint'):
+        opt.add_constraint(constraint)
+
+
+def remove_constraint(opt, constraint):
+    if hasattr(opt, 'remove_constraint'):
+        opt.remove_constraint(constraint)
+
+
+def update_constraint(opt, constraint):
+    """
+    Sends a constraint with a changed mutable parameter to the solver again
+    """
+    if hasattr(opt, 'remove_constraint'):
+        opt.remove_constraint(constraint)
+        opt.add_constraint(constraint)
+
+
+def update_var(opt, var):
+    """
+    Sends the new bounds of a variable to the solver
+    """
+    if hasattr(opt, 'update_var'):  # the appsi solvers find the change themselves
+        opt.update_var(var)
+
+
+def update_objective(opt, objective):
+    """
+    Sends an objective with changed mutable parameters to the solver again
+    """
+    if hasattr(opt, 'remove_constraint'):  # the appsi solvers find the change themselves
+        opt.set_objective(objective)
+
+
+def solve_and_load(opt, model, variables):
+    """
+    Solves the model, and loads at least the values of variables. gurobi_persistent only loads those, the appsi
+    solvers are faster loading all of them, and the other solvers always load all.
+    Check results.solver.termination_condition, gurobi_persistent loads nothing when no optimal solution is found
+    """
+    if hasattr(opt, 'remove_constraint'):
+        results = opt.solve(model, load_solutions=False)
+        if results.solver.termination_condition == TerminationCondition.optimal:  # else there is nothing to load
+            opt.load_vars(variables)
+        return results
+    return opt.solve(model, load_solutions=True)
+
+
+def load_duals(opt, constraints):
+    """
+    Loads the duals of the constraints into the model's dual suffix, the other solvers do this in solve()
+    """
+    if hasattr(opt, 'load_duals'):
+        opt.load_duals(cons_to_load=constraints)
+
+
+def benchmark_solvers(build_model, names=None, repeats=3):
+    """
+    Times each available solver on the same instance, built by build_model() for every solve.
+    Returns {solver name: {'time': best solve time in seconds, 'objective': objective value}}, None if not available
+    """
+    names = SOLVER_ORDER if names is None else names
+    results = {}
+    for name in names:
+        if not solver_available(name):
+            results[name] = None
+            continue
+
+        times = []
+        for _ in range(repeats):
+            model = build_model()
+            opt = make_solver(name)
+            start = time.perf_counter()
+            opt.solve(model, load_solutions=True)
+            times.append(time.perf_counter() - start)
+        objective = next(model.component_data_objects(pyo.Objective, active=True))
+        results[name] = {'time': min(times), 'objective': pyo.value(objective)}
+        print(f'{name}: {round(min(times), 4)} s, objective {round(results[name]["objective"], 2)}')
+
+    return results
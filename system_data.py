@@ -0,0 +1,205 @@
+import os
+
+import numpy as np
+
+
+M3S_TO_MM3 = 3.6/1000           # Convesion factor to MM^3
+
+
+class SystemData:
+    """
+    All the input data of the hydropower scheduling problem, shared by task1_model, the master- and the subproblems.
+    The time series are NumPy arrays over the hours 1-T, where the first hours_stage1 hours are stage 1 (the master
+    problem), and the rest are stage 2 (the subproblem):
+    - price:         (T,) market price pr. hour, EUR/MWh
+    - inflow:        (S, T) inflow pr. scenario and hour, Mm^3/h. Stage 1 is deterministic, so scenario 0 is used there
+    - probabilities: (S,) probability of each scenario
+    """
+
+    def __init__(self, price, inflow, probabilities=None, hours_stage1=24, V_max=10, V_01=5,
+                 Q_max=100 * M3S_TO_MM3, P_max=100, E_conv=0.981 / M3S_TO_MM3, WV_end=13000):
+        self.price = np.asarray(price, dtype=float)
+        self.inflow = np.atleast_2d(np.asarray(inflow, dtype=float))
+        if probabilities is None:
+            probabilities = np.full(self.inflow.shape[0], 1 / self.inflow.shape[0])  # equally probable scenarios
+        self.probabilities = np.asarray(probabilities, dtype=float)
+
+        if self.inflow.shape[1] != len(self.price):
+            raise ValueError(f'Inflow has {self.inflow.shape[1]} hours, but the price has {len(self.price)}')
+        if len(self.probabilities) != self.inflow.shape[0]:
+            raise ValueError(f'{len(self.probabilities)} probabilities given for {self.inflow.shape[0]} scenarios')
+
+        self.hours_stage1 = hours_stage1    # number of hours in stage 1
+        self.V_max = V_max                  # Mm^3, max water capacity in reservoir
+        self.V_01 = V_01                    # Mm^3, initial water level, Stage 1
+        self.Q_max = Q_max                  # Mm^3, max discharge pr. hour
+        self.P_max = P_max                  # MW (over 1 hour)
+        self.E_conv = E_conv                # MWh/Mm^3
+        self.WV_end = WV_end                # EUR/Mm^3, water value at the end of the horizon
+
+    @property
+    def T1(self):
+        return list(range(1, self.hours_stage1 + 1))                # hours of stage 1
+
+    @property
+    def T2(self):
+        return list(range(self.hours_stage1 + 1, len(self.price) + 1))  # hours of stage 2
+
+    @property
+    def S(self):
+        return list(range(self.inflow.shape[0]))                  # scenarios
+
+    def price_dict(self, hours):
+        return {t: float(self.price[t - 1]) for t in hours}         # {hour: price}, to initialize a pyo.Param
+
+    def inflow_stage1_dict(self):
+        return {t: float(self.inflow[0, t - 1]) for t in self.T1}   # {hour: inflow}, deterministic stage 1
+
+    def inflow_stage2_dict(self, scenarios=None):
+        scenarios = self.S if scenarios is None else scenarios
+        return {(t, s): float(self.inflow[s, t - 1]) for t in self.T2 for s in scenarios}  # {(hour, scenario): inflow}
+
+    def probability_dict(self, scenarios=None):
+        scenarios = self.S if scenarios is None else scenarios
+        return {s: float(self.probabilities[s]) for s in scenarios}  # {scenario: probability}
+
+    def save_npz(self, path):
+        """
+        Saves the system data to a NumPy .npz file, to be loaded again by load_system_data
+        """
+        np.savez(path, price=self.price, inflow=self.inflow, probabilities=self.probabilities,
+                 hours_stage1=self.hours_stage1, V_max=self.V_max, V_01=self.V_01, Q_max=self.Q_max,
+                 P_max=self.P_max, E_conv=self.E_conv, WV_end=self.WV_end)
+
+
+class CascadeData:
+    """
+    The input data of a cascade of R reservoirs, where the discharge (and spill) of a reservoir flows into the
+    reservoir downstream of it in the same hour. Like SystemData, with the values pr. reservoir:
+    - price:         (T,) market price pr. hour, EUR/MWh
+    - inflow:        (S, R, T) local inflow pr. scenario, reservoir and hour, Mm^3/h. Stage 1 uses scenario 0
+    - downstream:    (R,) the reservoir each reservoir flows into, -1 for none (the last one in the cascade)
+    - probabilities: (S,) probability of each scenario
+    V_max, V_01, Q_max, P_max, E_conv and WV_end are numbers (the same for all) or (R,) arrays
+    """
+
+    def __init__(self, price, inflow, downstream, probabilities=None, hours_stage1=24, V_max=10, V_01=5,
+                 Q_max=100 * M3S_TO_MM3, P_max=100, E_conv=0.981 / M3S_TO_MM3, WV_end=13000):
+        self.price = np.asarray(price, dtype=float)
+        self.inflow = np.asarray(inflow, dtype=float)
+        if self.inflow.ndim == 2:
+            self.inflow = self.inflow[None]  # one scenario
+        self.downstream = np.asarray(downstream, dtype=int)
+        if probabilities is None:
+            probabilities = np.full(self.inflow.shape[0], 1 / self.inflow.shape[0])  # equally probable scenarios
+        self.probabilities = np.asarray(probabilities, dtype=float)
+
+        if self.inflow.shape[1:] != (len(self.downstream), len(self.price)):
+            raise ValueError(f'Inflow has the shape {self.inflow.shape}, expected (S, {len(self.downstream)}, '
+                             f'{len(self.price)}) for the reservoirs and hours')
+        if len(self.probabilities) != self.inflow.shape[0]:
+            raise ValueError(f'{len(self.probabilities)} probabilities given for {self.inflow.shape[0]} scenarios')
+        if np.any(self.downstream >= len(self.downstream)) or np.any(self.downstream == np.arange(len(self.downstream))):
+            raise ValueError(f'Invalid downstream reservoirs: {self.downstream}')
+
+        R = len(self.downstream)
+        self.hours_stage1 = hours_stage1                    # number of hours in stage 1
+        self.V_max = np.broadcast_to(np.asarray(V_max, dtype=float), (R,))     # Mm^3, max water capacity pr. reservoir
+        self.V_01 = np.broadcast_to(np.asarray(V_01, dtype=float), (R,))       # Mm^3, initial water level pr. reservoir
+        self.Q_max = np.broadcast_to(np.asarray(Q_max, dtype=float), (R,))     # Mm^3, max discharge pr. hour
+        self.P_max = np.broadcast_to(np.asarray(P_max, dtype=float), (R,))     # MW (over 1 hour)
+        self.E_conv = np.broadcast_to(np.asarray(E_conv, dtype=float), (R,))   # MWh/Mm^3
+        self.WV_end = np.broadcast_to(np.asarray(WV_end, dtype=float), (R,))   # EUR/Mm^3, water value at the end
+
+    @property
+    def T1(self):
+        return list(range(1, self.hours_stage1 + 1))                # hours of stage 1
+
+    @property
+    def T2(self):
+        return list(range(self.hours_stage1 + 1, len(self.price) + 1))  # hours of stage 2
+
+    @property
+    def S(self):
+        return list(range(self.inflow.shape[0]))                  # scenarios
+
+    @property
+    def R(self):
+        return list(range(len(self.downstream)))                  # reservoirs
+
+    def upstream(self, r):
+        return [u for u in self.R if self.downstream[u] == r]       # the reservoirs flowing into r
+
+    def price_dict(self, hours):
+        return {t: float(self.price[t - 1]) for t in hours}         # {hour: price}, to initialize a pyo.Param
+
+    def inflow_stage1_dict(self):
+        return {(t, r): float(self.inflow[0, r, t - 1]) for t in self.T1 for r in self.R}  # {(hour, reservoir): inflow}
+
+    def inflow_stage2_dict(self, scenarios=None):
+        scenarios = self.S if scenarios is None else scenarios
+        return {(t, r, s): float(self.inflow[s, r, t - 1]) for t in self.T2 for r in self.R for s in scenarios}
+
+    def probability_dict(self, scenarios=None):
+        scenarios = self.S if scenarios is None else scenarios
+        return {s: float(self.probabilities[s]) for s in scenarios}  # {scenario: probability}
+
+    def reservoir_dict(self, values):
+        return {r: float(values[r]) for r in self.R}                # {reservoir: value} of an (R,) array
+
+
+def default_cascade_data(num_reservoirs=5):
+    """
+    A chain of num_reservoirs reservoirs, each flowing into the next, with the price and the scenarios of the project
+    task. The first reservoir gets the inflow of the project task, the others half of it
+    """
+    single = default_system_data()
+    local = np.where(np.arange(num_reservoirs) == 0, 1.0, 0.5)     # share of the inflow pr. reservoir
+    inflow = single.inflow[:, None, :] * local[None, :, None]       # (S, R, T)
+    downstream = np.append(np.arange(1, num_reservoirs), -1)        # r flows into r + 1, the last one out
+    return CascadeData(single.price, inflow, downstream, probabilities=single.probabilities)
+
+
+def default_system_data():
+    """
+    The system data of the project task: 48 hours with the price 50 + t, an inflow of 50 m^3/s in stage 1, and
+    5 equally probable scenarios with 25 * s m^3/s in stage 2
+    """
+    hours = np.arange(1, 49)
+    price = 50 + hours                                          # Start-value of market price + t
+    S = np.arange(0, 5)                                         # Scenario 0-4
+    inflow = np.where(hours <= 24, 50 * M3S_TO_MM3, 25 * M3S_TO_MM3 * S[:, None])  # Mm^3/h, stage 1 and 2
+    return SystemData(price, inflow, probabilities=np.full(len(S), 0.2))
+
+
+def load_system_data(path, **kwargs):
+    """
+    Loads the system data from a columnar file, parsed once and passed into every model builder.
+    - .npz:           the arrays and values saved by SystemData.save_npz
+    - .csv/.parquet:  one row pr. hour, with the column 'price' and one column 'inflow_<s>' pr. scenario (in Mm^3/h).
+                      The other values (probabilities, V_max, ...) are given as keyword arguments
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.npz':
+        with np.load(path) as npz:
+            values = {key: npz[key] for key in npz.files}
+        for key in values:
+            if values[key].ndim == 0:
+                values[key] = values[key].item()  # the single values are stored as 0-d arrays
+        values.update(kwargs)
+        return SystemData(**values)
+
+    if extension == '.csv':
+        table = np.genfromtxt(path, delimiter=',', names=True)
+        columns = {name: table[name] for name in table.dtype.names}
+    elif extension == '.parquet':
+        import pyarrow.parquet as pq  # only needed for Parquet files
+        table = pq.read_table(path)
+        columns = {name: column.to_numpy() for name, column in zip(table.column_names, table.columns)}
+    else:
+        raise ValueError(f'Unknown system data file type: {extension}')
+
+    inflow_columns = sorted((name for name in columns if name.startswith('inflow_')), key=lambda n: int(n[7:]))
+    inflow = np.stack([columns[name] for name in inflow_columns])
+    return SystemData(columns['price'], inflow, **kwargs)